@@ -50,11 +50,16 @@ from carla import ColorConverter as cc
 
 import argparse
 import collections
+import concurrent.futures
+import csv
 import datetime
+import json
 import logging
 import math
+import queue
 import random
 import re
+import threading
 import weakref
 import time
 
@@ -107,6 +112,15 @@ try:
 except ImportError:
     raise RuntimeError('cannot import numpy, make sure numpy package is installed')
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from world_cache import WorldStateCache
+from world_cache import blueprint_extent
+from world_cache import get_map_cache
+
 # ================
 # -- CustomTimer
 # ================
@@ -119,18 +133,127 @@ class CustomTimer:
     def time(self):
         return self.timer()
 
+# ================
+# -- FrameProfiler
+# ================
+
+class FrameProfiler:
+    """Per-stage frame times of game_loop, kept over a sliding window of ticks.
+
+    Call begin_tick() at the top of the loop and lap(stage) after every stage;
+    end_tick() also folds in the decode time the sensors spent since last tick.
+    """
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, window=1200, dump_path=None, dump_interval=10.0):
+        self.timer = CustomTimer()
+        self.window = window
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.ticks = 0
+        self.show_overlay = False
+        self._samples = collections.OrderedDict()
+        self._t_lap = None
+        self._t_tick = None
+        self._sensor_time = {}
+        self._next_dump = self.timer.time() + dump_interval
+        self._font = None
+        self._overlay = None
+
+    def _record(self, stage, ms):
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = collections.deque(maxlen=self.window)
+        samples.append(ms)
+
+    def begin_tick(self):
+        self._t_tick = self._t_lap = self.timer.time()
+
+    def lap(self, stage):
+        now = self.timer.time()
+        self._record(stage, 1000.0 * (now - self._t_lap))
+        self._t_lap = now
+
+    def end_tick(self, sensors=()):
+        now = self.timer.time()
+        self._record('frame', 1000.0 * (now - self._t_tick))
+        decode = 0.0
+        for sensor in sensors:
+            last = self._sensor_time.get(id(sensor), 0.0)
+            self._sensor_time[id(sensor)] = sensor.time_processing
+            decode += sensor.time_processing - last
+        if sensors:
+            self._record('decode', 1000.0 * decode)
+        self.ticks += 1
+        if self.dump_path and now >= self._next_dump:
+            self._next_dump = now + self.dump_interval
+            self.dump()
+
+    def summary(self):
+        result = collections.OrderedDict()
+        for stage, samples in self._samples.items():
+            values = np.fromiter(samples, dtype=np.float64, count=len(samples))
+            p = np.percentile(values, self.PERCENTILES)
+            result[stage] = collections.OrderedDict([
+                ('count', len(values)), ('mean', float(values.mean())),
+                ('p50', float(p[0])), ('p95', float(p[1])), ('p99', float(p[2])), ('max', float(values.max()))])
+        return result
+
+    def dump(self, path=None):
+        path = path or self.dump_path
+        summary = self.summary()
+        stamp = datetime.datetime.now().isoformat()
+        if path.endswith('.csv'):
+            new_file = not os.path.exists(path)
+            with open(path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(['time', 'ticks', 'stage', 'count', 'mean', 'p50', 'p95', 'p99', 'max'])
+                for stage, stats in summary.items():
+                    writer.writerow([stamp, self.ticks, stage, stats['count']] +
+                                    ['%.3f' % stats[k] for k in ('mean', 'p50', 'p95', 'p99', 'max')])
+        else:
+            # One JSON object per line so the file can be appended to while driving.
+            with open(path, 'a') as f:
+                f.write(json.dumps({'time': stamp, 'ticks': self.ticks, 'stages': summary}) + '\n')
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+
+    def render(self, surface, refresh_ticks=20):
+        """Draws the p50/p95/p99 table, returns its rect or None when hidden."""
+        if not self.show_overlay:
+            return None
+        if self._overlay is None or self.ticks % refresh_ticks == 0:
+            if self._font is None:
+                self._font = pygame.font.Font(pygame.font.get_default_font(), 16)
+            lines = ['%-18s %7s %7s %7s' % ('stage [ms]', 'p50', 'p95', 'p99')]
+            for stage, stats in self.summary().items():
+                lines.append('%-18s %7.2f %7.2f %7.2f' % (stage, stats['p50'], stats['p95'], stats['p99']))
+            texts = [self._font.render(line, True, (255, 255, 255)) for line in lines]
+            width = max(t.get_width() for t in texts) + 12
+            self._overlay = pygame.Surface((width, 20 * len(texts) + 8))
+            self._overlay.set_alpha(180)
+            for n, text in enumerate(texts):
+                self._overlay.blit(text, (6, 4 + 20 * n))
+        return surface.blit(self._overlay, (0, 0))
+
 # ================
 # -- DisplayManager
 # ================
 
 class DisplayManager:
-    def __init__(self, grid_size, window_size):
+    def __init__(self, grid_size, window_size, decoder=None):
         pygame.init()
         pygame.font.init()
         self.display = pygame.display.set_mode(window_size, pygame.HWSURFACE | pygame.DOUBLEBUF)
         self.grid_size = grid_size
         self.window_size = window_size
         self.sensor_list = []
+        self.mask_cache = MaskCache()
+        self.decoder = decoder
+        self._damaged_rects = []
+        self._dirty_rects = []
     def get_window_size(self):
         return [int(self.window_size[0]), int(self.window_size[1])]
     def get_display_size(self):
@@ -145,16 +268,56 @@ class DisplayManager:
     def render(self):
         if not self.render_enabled():
             return
+        # Sensors without a new frame are skipped unless something drawn over them
+        # this tick (or an invalidated area) has to be covered again.
+        damaged = self._damaged_rects
+        self._damaged_rects = []
         for s in self.sensor_list:
-            s.render()
-        pygame.display.flip()
+            rect = s.render(force=s.get_rect().collidelist(damaged) != -1)
+            if rect is not None:
+                damaged.append(rect)
+        self._dirty_rects = damaged
+    def invalidate(self, rect):
+        self._damaged_rects.append(pygame.Rect(rect))
+    def present(self, rects=()):
+        dirty = self._dirty_rects + [r for r in rects if r is not None]
+        self._dirty_rects = []
+        if dirty:
+            pygame.display.update(dirty)
     def destroy(self):
         for s in self.sensor_list:
             s.destroy()
+        if self.decoder is not None:
+            self.decoder.shutdown()
     def render_enabled(self):
         return self.display != None
 
 
+# ================
+# -- MaskCache
+# ================
+
+class MaskCache:
+    """Rear-view mirror masks, decoded and scaled once per (mask_path, overlay_size)."""
+    def __init__(self):
+        self._masks = {}
+    def get(self, mask_path, overlay_size):
+        key = (mask_path, tuple(overlay_size))
+        mask_image = self._masks.get(key)
+        if mask_image is None:
+            # A new size for this mask replaces the previously scaled copy.
+            self.invalidate(mask_path)
+            mask_image = pygame.image.load(mask_path).convert_alpha()
+            mask_image = pygame.transform.scale(mask_image, key[1])
+            self._masks[key] = mask_image
+        return mask_image
+    def invalidate(self, mask_path=None):
+        if mask_path is None:
+            self._masks.clear()
+        else:
+            for key in [k for k in self._masks if k[0] == mask_path]:
+                del self._masks[key]
+
 
 # ==============================================================================
 # -- Global functions ----------------------------------------------------------
@@ -168,11 +331,200 @@ def find_weather_presets():
     return [(getattr(carla.WeatherParameters, x), name(x)) for x in presets]
 
 
+# Memory layout of carla.RadarDetection inside RadarMeasurement.raw_data.
+RADAR_DETECTION_DTYPE = np.dtype([
+    ('velocity', np.float32),
+    ('azimuth', np.float32),
+    ('altitude', np.float32),
+    ('depth', np.float32)])
+
+
 def get_actor_display_name(actor, truncate=250):
     name = ' '.join(actor.type_id.replace('_', '.').title().split('.')[1:])
     return (name[:truncate - 1] + u'\u2026') if len(name) > truncate else name
 
 
+# ==============================================================================
+# -- AudioBank -----------------------------------------------------------------
+# ==============================================================================
+
+
+AUDIO_DIR = 'C:\\mp3'
+
+
+class AudioBank(object):
+    """Every sound cue decoded once at startup, each on its own reserved mixer channel.
+
+    play() and stop() only queue a request and never block, so sensor callback
+    threads may call them; a single audio thread owns all mixer calls. While a
+    cue is playing, cues of lower priority are ducked to duck_volume.
+    """
+    # name -> (file, priority, loops)
+    CUES = collections.OrderedDict([
+        ('crash', ('crash1_volumndowndown.mp3', 3, 0)),
+        ('radar', ('distanceradar.mp3', 2, -1)),
+        ('blinker', ('soundblinker.mp3', 1, -1))])
+    _STOP = object()
+
+    def __init__(self, directory=AUDIO_DIR, enabled=True, duck_volume=0.4, max_requests=64):
+        self.enabled = enabled
+        self.duck_volume = duck_volume
+        self.dropped = 0
+        self._cues = {}
+        self._requests = queue.Queue(maxsize=max_requests)
+        self._thread = None
+        if not enabled:
+            return
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        pygame.mixer.set_num_channels(max(8, len(self.CUES)))
+        # 为每个音效保留一个专用通道，互不打断
+        pygame.mixer.set_reserved(len(self.CUES))
+        for index, (name, (filename, priority, loops)) in enumerate(self.CUES.items()):
+            path = os.path.join(directory, filename)
+            try:
+                sound = pygame.mixer.Sound(path)
+            except (pygame.error, IOError, OSError) as error:
+                logging.warning('cannot load sound %s: %s', path, error)
+                continue
+            self._cues[name] = (sound, pygame.mixer.Channel(index), priority, loops)
+        if not self._cues:
+            return
+        self._thread = threading.Thread(target=self._run, name='audio')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def play(self, name):
+        """Starts the cue unless it is already playing."""
+        self._post((name, True))
+
+    def stop(self, name):
+        self._post((name, False))
+
+    def _post(self, request):
+        if request[0] not in self._cues:
+            return
+        try:
+            self._requests.put_nowait(request)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        volumes = {}
+        while True:
+            try:
+                request = self._requests.get(timeout=0.05)
+            except queue.Empty:
+                request = None
+            if request is self._STOP:
+                break
+            if request is not None:
+                sound, channel, _, loops = self._cues[request[0]]
+                if request[1]:
+                    if not channel.get_busy():
+                        channel.play(sound, loops=loops)
+                else:
+                    channel.stop()
+            # 一次性音效播完后也要恢复被压低的通道，所以空闲时同样检查
+            playing = [priority for _, channel, priority, _ in self._cues.values() if channel.get_busy()]
+            top = max(playing) if playing else None
+            for name, (_, channel, priority, _) in self._cues.items():
+                volume = self.duck_volume if top is not None and priority < top else 1.0
+                if volumes.get(name) != volume:
+                    channel.set_volume(volume)
+                    volumes[name] = volume
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._requests.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        for _, channel, _, _ in self._cues.values():
+            channel.stop()
+
+
+# ==============================================================================
+# -- EventBus ------------------------------------------------------------------
+# ==============================================================================
+
+
+# 传感器回调线程里只生成这些事件，所有状态修改和pygame调用都在主循环中进行
+CollisionEvent = collections.namedtuple('CollisionEvent', 'frame other_actor_id other_actor_type intensity impulse')
+InvasionEvent = collections.namedtuple('InvasionEvent', 'frame lane_types')
+GnssEvent = collections.namedtuple('GnssEvent', 'frame latitude longitude')
+RadarEvent = collections.namedtuple('RadarEvent', 'frame proximity ttc closest')
+
+
+class EventBus(object):
+    """Bounded queue from sensor callback threads to the main loop.
+
+    publish() may be called from any thread and never blocks: deque append and
+    popleft are atomic, so producers take no lock, and an event that finds the
+    queue full is counted and dropped. The deque itself is unbounded so it can
+    never evict an older event behind that count; concurrent producers can
+    overshoot the capacity by at most one event each. dispatch() runs on the
+    main loop once per tick and hands every queued event to the handlers of
+    its type.
+    """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.max_depth = 0
+        self._events = collections.deque()
+        self._handlers = collections.defaultdict(list)
+        self._delivered = collections.Counter()
+        self._dropped = collections.Counter()
+        self._drop_lock = threading.Lock()     # 只在队列满时才会用到
+
+    def __len__(self):
+        return len(self._events)
+
+    def subscribe(self, event_type, handler):
+        self._handlers[event_type].append(handler)
+
+    def publish(self, event):
+        if len(self._events) >= self.capacity:
+            with self._drop_lock:
+                self._dropped[type(event).__name__] += 1
+            return False
+        self._events.append(event)
+        return True
+
+    def drain(self):
+        """Events queued so far, oldest first; later ones wait for the next call."""
+        depth = len(self._events)
+        self.max_depth = max(self.max_depth, depth)
+        events = [self._events.popleft() for _ in range(depth)]
+        for event in events:
+            self._delivered[type(event).__name__] += 1
+        return events
+
+    def discard(self):
+        """Drops the queued events, e.g. those of sensors that were just destroyed."""
+        depth = len(self._events)
+        events = [self._events.popleft() for _ in range(depth)]
+        with self._drop_lock:
+            for event in events:
+                self._dropped[type(event).__name__] += 1
+        return depth
+
+    def dispatch(self):
+        events = self.drain()
+        for event in events:
+            for handler in self._handlers.get(type(event), ()):
+                handler(event)
+        return len(events)
+
+    def stats(self):
+        with self._drop_lock:
+            dropped = dict(self._dropped)
+        return collections.OrderedDict([
+            ('depth', len(self._events)),
+            ('max_depth', self.max_depth),
+            ('delivered', dict(self._delivered)),
+            ('dropped', dropped)])
+
+
 # ==============================================================================
 # -- World ---------------------------------------------------------------------
 # ==============================================================================
@@ -186,8 +538,10 @@ class World(object):                 # World类
     # self在定义类的方法时是必须有的，虽然在调用时不必传入相应的参数。
     # python中类的实例化类似函数调用方式，并通过__init__方法接收参数。
     # __init__方法（构造函数）有三个参数：carla_world, hud, actor_filter
-    def __init__(self, carla_world, actor_filter):  # __init__方法：carla_world, hud, actor_filter作为参数
+    def __init__(self, carla_world, actor_filter, spawn_point=None, audio=None):  # __init__方法：carla_world, hud, actor_filter作为参数
         self.world = carla_world    # 初始化各种成员变量：carla世界对象
+        self.state = WorldStateCache()  # 每个tick刷新一次的快照，逐帧读取actor状态不再单独发RPC
+        self.map_cache = get_map_cache(carla_world)  # 蓝图库和生成点只取一次，load_world后重建
         # self.hud = hud
         self.player = None            # 初始化各种成员变量：玩家角色
         self.collision_sensor = None
@@ -197,8 +551,19 @@ class World(object):                 # World类
         self._weather_presets = find_weather_presets()
         self._weather_index = 0
         self._actor_filter = actor_filter
+        self.spawn_point = spawn_point      # 回放时在录制的位置生成hero
+        self.audio = audio if audio is not None else AudioBank(enabled=False)
+        self.events = EventBus()
+        self.events.subscribe(CollisionEvent, self._on_collision)
+        self.events.subscribe(GnssEvent, self._on_gnss)
+        self.events.subscribe(RadarEvent, self._on_radar)
         self.restart()
         self.radar_sensor = None
+        self.radar_alert_distance = 2.0
+        self.radar_proximity = float('inf')
+        self.radar_closest = None
+        self.radar_ttc = float('inf')
+        self._radar_alert = False
         self.add_radar_sensor()
         # self.world.on_tick(hud.on_world_tick)
 
@@ -209,7 +574,7 @@ class World(object):                 # World类
         # Get a random blueprint.
         # blueprint = random.choice(self.world.get_blueprint_library().filter(self._actor_filter))
 
-        blueprint = self.world.get_blueprint_library().find('vehicle.audi.a2')
+        blueprint = self.map_cache.find('vehicle.audi.a2')
         # blueprint = self.world.get_blueprint_library().find('vehicle.tesla.model3')
         blueprint.set_attribute('role_name', 'hero')       # 设定hero车辆 即player
         if blueprint.has_attribute('color'):
@@ -217,22 +582,38 @@ class World(object):                 # World类
             blueprint.set_attribute('color', color)
         # Spawn the player.
         if self.player is not None:
-            spawn_point = self.player.get_transform()
+            spawn_point = self.state.transform(self.player.id) or self.player.get_transform()
             spawn_point.location.z += 2.0
             spawn_point.rotation.roll = 0.0
             spawn_point.rotation.pitch = 0.0
             self.destroy()
+            # 旧传感器还没处理的事件不能记到新车上
+            self.events.discard()
             self.player = self.world.try_spawn_actor(blueprint, spawn_point)
-            print(f"generate'hero'vehicle:ID{self.player.id}")
-        while self.player is None:
-            spawn_points = self.world.get_map().get_spawn_points()
-            spawn_point = random.choice(spawn_points) if spawn_points else carla.Transform()
+        elif self.spawn_point is not None:
+            # 只有回放时才会传入生成点，换到别的位置回放就和日志对不上了
+            spawn_point = self.spawn_point
             self.player = self.world.try_spawn_actor(blueprint, spawn_point)
-            print(f"generate'hero'vehicle:ID{self.player.id}")
+            if self.player is None:
+                raise RuntimeError('recorded spawn point %s is occupied, the replay would diverge from the journal'
+                                   % _transform_to_list(spawn_point))
+        if self.player is None:
+            # 生成点不放回地随机抽取，并跳过被现有车辆和行人包围盒占用的点
+            actors = self.world.get_actors()
+            planner = self.map_cache.spawn_planner(
+                list(actors.filter('vehicle.*')) + list(actors.filter('walker.pedestrian.*')))
+            while self.player is None:
+                spawn_points = planner.take(1, blueprint_extent(blueprint))
+                if not spawn_points:
+                    raise RuntimeError('no free spawn point left for the hero vehicle')
+                spawn_point = spawn_points[0]
+                self.player = self.world.try_spawn_actor(blueprint, spawn_point)
+        self.spawn_point = spawn_point
+        print(f"generate'hero'vehicle:ID{self.player.id}")
         # Set up the sensors.
-        self.collision_sensor = CollisionSensor(self.player)
-        self.lane_invasion_sensor = LaneInvasionSensor(self.player)
-        self.gnss_sensor = GnssSensor(self.player)
+        self.collision_sensor = CollisionSensor(self.player, self.events)
+        self.lane_invasion_sensor = LaneInvasionSensor(self.player, self.events)
+        self.gnss_sensor = GnssSensor(self.player, self.events)
         # self.camera_manager = CameraManager(self.player, self.hud)
         # self.camera_manager.transform_index = cam_pos_index
         # self.camera_manager.set_sensor(cam_index, notify=False)
@@ -267,7 +648,7 @@ class World(object):                 # World类
             self.player.destroy()
 
     def add_radar_sensor(self):
-        radar_bp = self.world.get_blueprint_library().find('sensor.other.radar')
+        radar_bp = self.map_cache.find('sensor.other.radar')
         radar_bp.set_attribute('horizontal_fov', '30')  # 30度的水平视场
         radar_bp.set_attribute('vertical_fov', '5')    # 5度的垂直视场
         radar_bp.set_attribute('range', '100')          # 20米范围
@@ -276,19 +657,231 @@ class World(object):                 # World类
         self.radar_sensor.listen(lambda radar_data: self.process_radar_data(radar_data))
 
     def process_radar_data(self, radar_data):
-        close_vehicle_detected = False
-        for detection in radar_data:
-            if detection.depth < 2.0:  # 检测距离小于2米的对象
-                close_vehicle_detected = True
-                break
-
-        if close_vehicle_detected:
-            if not pygame.mixer.music.get_busy():  # 如果没有音乐正在播放
-                pygame.mixer.music.load('C:\mp3\distanceradar.mp3')
-                print("detected")
-                pygame.mixer.music.play(-1)  # 使用-1使音乐循环播放
+        # 回调线程：只做数值计算，结果作为事件交给主循环
+        detections = np.frombuffer(radar_data.raw_data, dtype=RADAR_DETECTION_DTYPE)
+        if len(detections):
+            depth = detections['depth']
+            closest = int(np.argmin(depth))
+            # 径向速度为负表示目标正在靠近
+            closing_speed = -detections['velocity']
+            ttc = np.full(len(detections), np.inf, dtype=np.float32)
+            np.divide(depth, closing_speed, out=ttc, where=closing_speed > 0)
+            event = RadarEvent(radar_data.frame, float(depth[closest]), float(ttc.min()), detections[closest].copy())
         else:
-            pygame.mixer.music.stop()  # 停止播放音乐
+            event = RadarEvent(radar_data.frame, float('inf'), float('inf'), None)
+        self.events.publish(event)
+
+    def _on_radar(self, event):
+        self.radar_closest = event.closest
+        self.radar_proximity = event.proximity
+        self.radar_ttc = event.ttc
+        close_vehicle_detected = self.radar_proximity < self.radar_alert_distance  # 检测距离小于2米的对象
+
+        # 只在状态变化时开关报警音
+        if close_vehicle_detected != self._radar_alert:
+            self._radar_alert = close_vehicle_detected
+            if close_vehicle_detected:
+                print("detected")
+                self.audio.play('radar')  # 循环播放
+            else:
+                self.audio.stop('radar')  # 停止播放
+
+    def _on_collision(self, event):
+        self.collision_sensor.history.append(event.frame, event.intensity, event.other_actor_id, event.impulse)
+        # 0318 播放碰撞音效，上一次还没播完时不重复触发
+        self.audio.play('crash')
+
+    def _on_gnss(self, event):
+        self.gnss_sensor.lat = event.latitude
+        self.gnss_sensor.lon = event.longitude
+
+# ==============================================================================
+# -- InputMapper ---------------------------------------------------------------
+# ==============================================================================
+
+
+WHEEL_CONFIG = 'C:\CARLA_0.9.15\WindowsNoEditor\PythonAPI\examples\wheel_config.ini'  # wheel_config.ini的绝对路径
+WHEEL_SECTION = 'G29 Racing Wheel'
+
+
+class ResponseCurve(object):
+    """A response curve on raw axis values in [-1, 1], sampled once into a lookup table.
+
+    Calls interpolate linearly between the two nearest samples, so the per-frame
+    cost does not depend on how expensive the curve is to evaluate.
+    """
+    SIZE = 1025
+
+    def __init__(self, function, size=SIZE):
+        self._lut = [float(function(x)) for x in np.linspace(-1.0, 1.0, size)]
+        self._scale = (size - 1) / 2.0
+        self._last = size - 1
+
+    def __call__(self, x):
+        position = (x + 1.0) * self._scale
+        if position <= 0.0:
+            return self._lut[0]
+        index = int(position)
+        if index >= self._last:
+            return self._lut[self._last]
+        low = self._lut[index]
+        return low + (self._lut[index + 1] - low) * (position - index)
+
+
+def _clamp01(value):
+    return min(1.0, max(0.0, value))
+
+
+def _curve_function(kind, gain, offset, pedal):
+    """Curve kinds: 'tan' and 'log' are the G29 formulas tuned for the simulator,
+    'linear', or a list of 'x:y' points to interpolate between."""
+    if kind == 'tan':
+        return lambda x: gain * math.tan(1.1 * x)
+    if kind == 'log':
+        # 踏板松开时轴值为1，踩到底为-1
+        return lambda x: _clamp01(offset + (2.05 * math.log10(-0.7 * x + 1.4) - 1.2) / 0.92)
+    if kind == 'linear':
+        if pedal:
+            return lambda x: _clamp01(gain * (1.0 - x) / 2.0)
+        return lambda x: gain * x
+    points = sorted(tuple(float(v) for v in point.split(':')) for point in kind.split())
+    if len(points) < 2 or any(len(point) != 2 for point in points):
+        raise ValueError('response curve must be tan, log, linear or at least two x:y points, got %r' % kind)
+    xs, ys = zip(*points)
+    return lambda x: float(np.interp(x, xs, ys))
+
+
+def _with_deadzone(function, deadzone, pedal):
+    # 死区按轴的静止位置计算：方向盘在0附近，踏板在松开的一端(1)
+    if deadzone <= 0.0:
+        return function
+    if pedal:
+        def mapped(x):
+            travel = (1.0 - x) / 2.0
+            travel = max(0.0, (travel - deadzone) / (1.0 - deadzone))
+            return function(1.0 - 2.0 * travel)
+    else:
+        def mapped(x):
+            if abs(x) <= deadzone:
+                return function(0.0)
+            return function(math.copysign((abs(x) - deadzone) / (1.0 - deadzone), x))
+    return mapped
+
+
+class InputMapper(object):
+    """Reads the configured wheel axes and handbrake button into a VehicleControl.
+
+    Each axis goes through a ResponseCurve built from wheel_config.ini, with the
+    deadzone folded into the table. A '[profile NAME]' section overrides any key
+    of the wheel section, so per-participant calibrations need no code changes.
+    """
+    # key prefix -> (is pedal, default curve, default gain, default offset)
+    AXES = collections.OrderedDict([
+        ('steering', (False, 'tan', 0.15, 0.0)),
+        ('throttle', (True, 'log', 1.0, 1.35)),
+        ('brake', (True, 'log', 1.0, 1.6))])
+
+    def __init__(self, steer_idx, throttle_idx, brake_idx, handbrake_idx, curves):
+        self.steer_idx = steer_idx
+        self.throttle_idx = throttle_idx
+        self.brake_idx = brake_idx
+        self.handbrake_idx = handbrake_idx
+        self.steer_curve, self.throttle_curve, self.brake_curve = curves
+
+    @classmethod
+    def from_config(cls, parser, section=WHEEL_SECTION, profile=None):
+        options = dict(parser.items(section))
+        profile = profile or options.get('profile')
+        if profile:
+            profile_section = 'profile %s' % profile
+            if not parser.has_section(profile_section):
+                raise ValueError('no [%s] section in the wheel config' % profile_section)
+            options.update(parser.items(profile_section))
+        curves = []
+        for name, (pedal, kind, gain, offset) in cls.AXES.items():
+            function = _curve_function(
+                options.get(name + '_curve', kind).strip(),
+                float(options.get(name + '_gain', gain)),
+                float(options.get(name + '_offset', offset)),
+                pedal)
+            curves.append(ResponseCurve(_with_deadzone(function, float(options.get(name + '_deadzone', 0.0)), pedal)))
+        return cls(int(options['steering_wheel']), int(options['throttle']), int(options['brake']),
+                   int(options['handbrake']), curves)
+
+    def sample(self, joystick):
+        """(steer, throttle, brake, hand_brake) for the current wheel state."""
+        return (self.steer_curve(joystick.get_axis(self.steer_idx)),
+                self.throttle_curve(joystick.get_axis(self.throttle_idx)),
+                self.brake_curve(joystick.get_axis(self.brake_idx)),
+                bool(joystick.get_button(self.handbrake_idx)))
+
+    def read(self, joystick, control):
+        control.steer, control.throttle, control.brake, control.hand_brake = self.sample(joystick)
+        return control
+
+
+class InputSampler(object):
+    """Reads the wheel on the main thread at the last moment before each tick.
+
+    SDL only refreshes joystick state when the main thread pumps events, so a
+    polling thread would re-read values that change once per tick. Instead
+    sample() pumps events and maps the axes right before apply_control.
+    Steering and pedals can go through a one-pole low-pass filter (cutoff in
+    Hz, 0 disables it) whose coefficient follows the measured sample interval.
+    The age of a sample is measured from the latest event pump to the moment
+    the control is sent.
+    """
+    def __init__(self, joystick, mapper, cutoff=0.0, window=5000):
+        self.joystick = joystick
+        self.mapper = mapper
+        self.cutoff = cutoff
+        self.timer = CustomTimer()
+        self._filtered = None
+        self._last = None
+        self._pumped = None
+        # 采样间隔和样本下发时距上次事件泵的时延，用于统计输入延迟抖动
+        self._intervals = collections.deque(maxlen=window)
+        self._ages = collections.deque(maxlen=window)
+
+    def pumped(self):
+        """Notes that the main loop has just pumped events and refreshed SDL's joystick state."""
+        self._pumped = self.timer.time()
+
+    def sample(self):
+        """Pumps events and returns the current (steer, throttle, brake, hand_brake)."""
+        pygame.event.pump()
+        self.pumped()
+        steer, throttle, brake, hand_brake = self.mapper.sample(self.joystick)
+        now = self._pumped
+        if self._last is not None:
+            interval = now - self._last
+            self._intervals.append(interval)
+            if self.cutoff > 0:
+                alpha = 1.0 - math.exp(-2.0 * math.pi * self.cutoff * interval)
+                last_steer, last_throttle, last_brake = self._filtered
+                steer = last_steer + alpha * (steer - last_steer)
+                throttle = last_throttle + alpha * (throttle - last_throttle)
+                brake = last_brake + alpha * (brake - last_brake)
+        self._filtered = (steer, throttle, brake)
+        self._last = now
+        return steer, throttle, brake, hand_brake
+
+    def applied(self):
+        """Records how old the input was when the control built from it was sent."""
+        if self._pumped is not None:
+            self._ages.append(self.timer.time() - self._pumped)
+
+    def stats(self):
+        result = collections.OrderedDict()
+        for name, samples in (('interval', self._intervals), ('age', self._ages)):
+            if samples:
+                values = 1000.0 * np.fromiter(samples, dtype=np.float64, count=len(samples))
+                p = np.percentile(values, (50, 99))
+                result[name] = collections.OrderedDict([
+                    ('mean', float(values.mean())), ('p50', float(p[0])), ('p99', float(p[1])),
+                    ('jitter', float(values.std()))])
+        return result
+
 
 # ==============================================================================
 # -- DualControl -----------------------------------------------------------
@@ -296,9 +889,8 @@ class World(object):                 # World类
 
 
 class DualControl(object):
-    def __init__(self, world, start_in_autopilot):
-        pygame.mixer.init()
-        pygame.mixer.music.load('C:\mp3\soundblinker.mp3')
+    def __init__(self, world, start_in_autopilot, profiler=None, wheel_config=WHEEL_CONFIG, input_profile=None,
+                 late_input=False, input_cutoff=0.0):
         # self.left_blinker_sound = pygame.mixer.Sound('C:\mp3\sound.mp3')
         self._autopilot_enabled = start_in_autopilot
         if isinstance(world.player, carla.Vehicle):
@@ -313,6 +905,7 @@ class DualControl(object):
         else:
             raise NotImplementedError("Actor type not supported")
         self._steer_cache = 0.0
+        self._profiler = profiler
         # world.hud.notification("Press 'H' or '?' for help.", seconds=4.0)
 
         # initialize steering wheel
@@ -326,18 +919,19 @@ class DualControl(object):
         self._joystick.init()
 
         self._parser = ConfigParser()
-        self._parser.read('C:\CARLA_0.9.15\WindowsNoEditor\PythonAPI\examples\wheel_config.ini')  # wheel_config.ini的绝对路径
-        self._steer_idx = int(
-            self._parser.get('G29 Racing Wheel', 'steering_wheel'))
-        self._throttle_idx = int(
-            self._parser.get('G29 Racing Wheel', 'throttle'))
-        self._brake_idx = int(self._parser.get('G29 Racing Wheel', 'brake'))
-        self._reverse_idx = int(self._parser.get('G29 Racing Wheel', 'reverse'))
-        self._handbrake_idx = int(
-            self._parser.get('G29 Racing Wheel', 'handbrake'))
-        self._RightBlinker_idx = int(self._parser.get('G29 Racing Wheel', 'RightBlinker'))
-        self._LeftBlinker_idx = int(self._parser.get('G29 Racing Wheel', 'LeftBlinker'))
-        self._HighBeam_idx = int(self._parser.get('G29 Racing Wheel', 'HighBeam'))
+        self._parser.read(wheel_config)
+        self._reverse_idx = int(self._parser.get(WHEEL_SECTION, 'reverse'))
+        self._RightBlinker_idx = int(self._parser.get(WHEEL_SECTION, 'RightBlinker'))
+        self._LeftBlinker_idx = int(self._parser.get(WHEEL_SECTION, 'LeftBlinker'))
+        self._HighBeam_idx = int(self._parser.get(WHEEL_SECTION, 'HighBeam'))
+        self._LowBeam_idx = int(self._parser.get(WHEEL_SECTION, 'LowBeam', fallback='5'))
+        # 方向盘和踏板的响应曲线预先算成查找表，可按被试切换profile
+        self._input_mapper = InputMapper.from_config(self._parser, WHEEL_SECTION, input_profile)
+        self._check_buttons()
+        # late_input时在tick前的最后一刻重新读取方向盘，而不是在处理事件时读取
+        self._sampler = None
+        if late_input:
+            self._sampler = InputSampler(self._joystick, self._input_mapper, input_cutoff)
 
         #0314
         # self._initial_steer_direction = None  # 添加这行来初始化初始方向盘转动方向
@@ -347,9 +941,15 @@ class DualControl(object):
         if isinstance(self._control, carla.VehicleControl):
             current_lights = self._lights
 
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        if self._sampler is not None:
+            self._sampler.pumped()
+        for event in events:
             if event.type == pygame.QUIT:
                 return True
+            elif event.type == pygame.KEYUP and event.key == K_F1:
+                if self._profiler is not None:
+                    self._profiler.toggle_overlay()
             elif event.type == pygame.JOYBUTTONDOWN:
                 if event.button == 0:
                     world.restart()
@@ -365,21 +965,12 @@ class DualControl(object):
                     # world.camera_manager.next_sensor()
                 elif event.button == self._RightBlinker_idx:
                     current_lights ^= carla.VehicleLightState.RightBlinker
-                    if current_lights & carla.VehicleLightState.RightBlinker:
-                        if not pygame.mixer.music.get_busy():
-                            pygame.mixer.music.play(loops=-1)
-                            # 0314 当右转向灯开启时，记录当前方向盘转动方向为初始转动方向
-                            # self._initial_steer_direction = self._control.steer >= 0
-                    else:
-                        pygame.mixer.music.stop()
-                        # self._initial_steer_direction = None   # 0314
+                    # 0314 当右转向灯开启时，记录当前方向盘转动方向为初始转动方向
+                    # self._initial_steer_direction = self._control.steer >= 0
+                    self._update_blinker_sound(world, current_lights)
                 elif event.button == self._LeftBlinker_idx:
                     current_lights ^= carla.VehicleLightState.LeftBlinker
-                    if current_lights & carla.VehicleLightState.LeftBlinker:
-                        if not pygame.mixer.music.get_busy():
-                            pygame.mixer.music.play(loops=-1)
-                    else:
-                        pygame.mixer.music.stop()
+                    self._update_blinker_sound(world, current_lights)
                 elif event.button == self._HighBeam_idx:
                     current_lights ^= carla.VehicleLightState.HighBeam  # HighBeam效果比较明显
                     # if current_lights & carla.VehicleLightState.HighBeam:
@@ -387,7 +978,7 @@ class DualControl(object):
                     #         pygame.mixer.music.play(loops=-1)
                     # else:
                     #     pygame.mixer.music.stop()
-                elif event.button == 5:
+                elif event.button == self._LowBeam_idx:
                     current_lights ^= carla.VehicleLightState.LowBeam  # LowBeam效果不大不用管
                 # elif event.button == self._Interior_idx:
                 #     current_lights ^= carla.VehicleLightState.Interior
@@ -435,6 +1026,16 @@ class DualControl(object):
             if isinstance(self._control, carla.VehicleControl):
                 self._parse_vehicle_keys(pygame.key.get_pressed(), clock.get_time())
                 self._parse_vehicle_wheel()
+                # # 0314 检查是否需要关闭右转向灯
+                # if self._initial_steer_direction is not None:
+                #     current_steer_direction = self._control.steer >= 0
+                #     # 如果方向盘转动方向与初始方向相反，则关闭右转向灯
+                #     if current_steer_direction != self._initial_steer_direction:
+                #         self._lights &= ~carla.VehicleLightState.RightBlinker
+                #         # self._lights &= ~carla.VehicleLightState.LeftBlinker
+                #         pygame.mixer.music.stop()  # 停止播放转向灯声音
+                #         self._initial_steer_direction = None  # 重置初始方向盘转动方向
+                #         # world.player.set_light_state(carla.VehicleLightState(self._lights))  # 更新车辆的灯光状态
                 self._control.reverse = self._control.gear < 0
                 # Set automatic control-related vehicle lights
                 if self._control.brake:
@@ -450,7 +1051,52 @@ class DualControl(object):
                     world.player.set_light_state(carla.VehicleLightState(self._lights))
             elif isinstance(self._control, carla.WalkerControl):
                 self._parse_walker_keys(pygame.key.get_pressed(), clock.get_time())
-            world.player.apply_control(self._control)
+
+    def _check_buttons(self):
+        # 同一个按键只能对应一个功能，否则先判断的分支会让后面的功能永远触发不到
+        buttons = collections.OrderedDict([
+            ('restart', 0), ('weather', 3), ('reverse', self._reverse_idx),
+            ('RightBlinker', self._RightBlinker_idx), ('LeftBlinker', self._LeftBlinker_idx),
+            ('HighBeam', self._HighBeam_idx), ('LowBeam', self._LowBeam_idx),
+            ('handbrake', self._input_mapper.handbrake_idx)])
+        used = {}
+        for name, button in buttons.items():
+            if button in used:
+                raise ValueError('%s and %s are both mapped to wheel button %d' % (used[button], name, button))
+            used[button] = name
+
+    @staticmethod
+    def _update_blinker_sound(world, lights):
+        # 左右转向灯共用一个提示音，任一侧开着就继续播放
+        if lights & (carla.VehicleLightState.RightBlinker | carla.VehicleLightState.LeftBlinker):
+            world.audio.play('blinker')
+        else:
+            world.audio.stop('blinker')
+
+    def apply_control(self, world):
+        """Sends the control to the server; call it right before world.tick()."""
+        if self._autopilot_enabled:
+            return
+        if self._sampler is not None and isinstance(self._control, carla.VehicleControl):
+            self._apply_sample()
+        world.player.apply_control(self._control)
+        if self._sampler is not None:
+            self._sampler.applied()
+
+    def input_stats(self):
+        return self._sampler.stats() if self._sampler is not None else None
+
+    def destroy(self):
+        pass
+
+    def get_light_state(self):
+        return self._lights
+
+    def get_control(self, world):
+        # Under autopilot the traffic manager drives, so only the server knows the gear.
+        if self._autopilot_enabled:
+            return world.player.get_control()
+        return self._control
 
     def _parse_vehicle_keys(self, keys, milliseconds):
         self._control.throttle = 1.0 if keys[K_UP] or keys[K_w] else 0.0
@@ -467,51 +1113,11 @@ class DualControl(object):
         self._control.hand_brake = keys[K_SPACE]
 
     def _parse_vehicle_wheel(self):
-        numAxes = self._joystick.get_numaxes()
-        jsInputs = [float(self._joystick.get_axis(i)) for i in range(numAxes)]
-        # print (jsInputs)
-        jsButtons = [float(self._joystick.get_button(i)) for i in
-                     range(self._joystick.get_numbuttons())]
-
-        # Custom function to map range of inputs [1, -1] to outputs [0, 1] i.e 1 from inputs means nothing is pressed
-        # For the steering, it seems fine as it is
-        # K1 = 0.225  # 0.55   # K1: 方向盘灵敏度。 注意每次都需要打开Logitech G29 Hub开启回正。
-        K1 =0.15 # 0.10
-        steerCmd = K1 * math.tan(1.1 * jsInputs[self._steer_idx])
-
-        K2 = 1.35  #1.3 # 1.6    # K2: 油门灵敏度
-        throttleCmd = K2 + (2.05 * math.log10(
-            -0.7 * jsInputs[self._throttle_idx] + 1.4) - 1.2) / 0.92
-        if throttleCmd <= 0:
-            throttleCmd = 0
-        elif throttleCmd > 1:
-            throttleCmd = 1
-
-        brakeCmd = 1.6 + (2.05 * math.log10(
-            -0.7 * jsInputs[self._brake_idx] + 1.4) - 1.2) / 0.92
-        if brakeCmd <= 0:
-            brakeCmd = 0
-        elif brakeCmd > 1:
-            brakeCmd = 1
-
-        self._control.steer = steerCmd
-        self._control.brake = brakeCmd
-        self._control.throttle = throttleCmd
-
-        #toggle = jsButtons[self._reverse_idx]
-
-        self._control.hand_brake = bool(jsButtons[self._handbrake_idx])
-
-        # # 0314 检查是否需要关闭右转向灯
-        # if self._initial_steer_direction is not None:
-        #     current_steer_direction = self._control.steer >= 0
-        #     # 如果方向盘转动方向与初始方向相反，则关闭右转向灯
-        #     if current_steer_direction != self._initial_steer_direction:
-        #         self._lights &= ~carla.VehicleLightState.RightBlinker
-        #         # self._lights &= ~carla.VehicleLightState.LeftBlinker
-        #         pygame.mixer.music.stop()  # 停止播放转向灯声音
-        #         self._initial_steer_direction = None  # 重置初始方向盘转动方向
-        #         # world.player.set_light_state(carla.VehicleLightState(self._lights))  # 更新车辆的灯光状态
+        self._input_mapper.read(self._joystick, self._control)
+
+    def _apply_sample(self):
+        self._control.steer, self._control.throttle, self._control.brake, self._control.hand_brake = \
+            self._sampler.sample()
 
     def _parse_walker_keys(self, keys, milliseconds):
         self._control.speed = 0.0
@@ -534,6 +1140,214 @@ class DualControl(object):
         return (key == K_ESCAPE) or (key == K_q and pygame.key.get_mods() & KMOD_CTRL)
 
 
+# ==============================================================================
+# -- ScriptedControl -----------------------------------------------------------
+# ==============================================================================
+
+
+def load_control_script(path):
+    """Reads (ticks, controls) from a CSV script or a --telemetry file.
+
+    A CSV has a 'tick' column and any of throttle, steer, brake, hand_brake and
+    reverse; each row holds until the next one. A telemetry file replays the
+    controls it recorded, one record per tick.
+    """
+    fields = ScriptedControl.FIELDS
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            rows = sorted(csv.DictReader(f), key=lambda row: int(row['tick']))
+        ticks = np.array([int(row['tick']) for row in rows], dtype=np.int64)
+        controls = [tuple(float(row.get(field) or 0.0) for field in fields) for row in rows]
+    else:
+        records = load_telemetry(path)
+        # 每条记录是在该tick之前、即上一个tick下发的控制量
+        ticks = np.arange(-1, len(records) - 1, dtype=np.int64)
+        controls = list(zip(*[records[field].astype(np.float64).tolist() for field in fields]))
+    return ticks, controls
+
+
+class ScriptedControl(object):
+    """Drives the hero from a control script instead of the wheel, for headless runs.
+
+    Without a script the hero slaloms at constant throttle. parse_events,
+    apply_control, get_control and get_light_state behave like DualControl's.
+    """
+    FIELDS = ('throttle', 'steer', 'brake', 'hand_brake', 'reverse')
+
+    def __init__(self, world, script=None, profiler=None):
+        self._control = carla.VehicleControl()
+        self._lights = carla.VehicleLightState.NONE
+        self._profiler = profiler
+        self.tick = 0
+        if script:
+            self._ticks, self._controls = load_control_script(script)
+        else:
+            self._ticks, self._controls = None, None
+        world.player.set_autopilot(False)
+        world.player.set_light_state(self._lights)
+
+    def _values(self, tick):
+        if self._ticks is None:
+            return 0.5, 0.3 * math.sin(2.0 * math.pi * tick / 200.0), 0.0, 0.0, 0.0
+        row = int(np.searchsorted(self._ticks, tick, side='right')) - 1
+        return self._controls[row] if row >= 0 else (0.0,) * len(self.FIELDS)
+
+    def parse_events(self, world, clock):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return True
+            elif event.type == pygame.KEYUP and event.key == K_F1:
+                if self._profiler is not None:
+                    self._profiler.toggle_overlay()
+        throttle, steer, brake, hand_brake, reverse = self._values(self.tick)
+        self.tick += 1
+        self._control.throttle = throttle
+        self._control.steer = steer
+        self._control.brake = brake
+        self._control.hand_brake = bool(hand_brake)
+        self._control.reverse = bool(reverse)
+        self._control.gear = -1 if reverse else 1
+        lights = self._lights
+        if brake:
+            lights |= carla.VehicleLightState.Brake
+        else:
+            lights &= ~carla.VehicleLightState.Brake
+        if reverse:
+            lights |= carla.VehicleLightState.Reverse
+        else:
+            lights &= ~carla.VehicleLightState.Reverse
+        if lights != self._lights:
+            self._lights = lights
+            world.player.set_light_state(carla.VehicleLightState(self._lights))
+
+    def apply_control(self, world):
+        world.player.apply_control(self._control)
+
+    def input_stats(self):
+        return None
+
+    def destroy(self):
+        pass
+
+    def get_light_state(self):
+        return self._lights
+
+    def get_control(self, world):
+        return self._control
+
+
+# ==============================================================================
+# -- InputJournal --------------------------------------------------------------
+# ==============================================================================
+
+
+INPUT_JOURNAL_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('steer', np.float32),
+    ('throttle', np.float32),
+    ('brake', np.float32),
+    ('gear', np.int8),
+    ('hand_brake', np.bool_),
+    ('reverse', np.bool_),
+    ('manual_gear_shift', np.bool_),
+    ('light_state', np.uint32)])
+
+
+def _transform_to_list(transform):
+    return [transform.location.x, transform.location.y, transform.location.z,
+            transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll]
+
+
+def _transform_from_list(values):
+    return carla.Transform(carla.Location(*values[:3]), carla.Rotation(*values[3:]))
+
+
+class InputJournal(object):
+    """Appends the control each synchronous tick ran with to a compact binary file.
+
+    Record n is the control that was applied before frame n. The '<path>.json'
+    sidecar keeps the dtype and what a replay needs to start from the same
+    state: the map, the tick length and the hero's spawn point.
+    """
+    def __init__(self, path, world, fixed_delta_seconds):
+        self.path = path
+        self.count = 0
+        self._record = np.zeros(1, dtype=INPUT_JOURNAL_DTYPE)
+        meta = {'dtype': INPUT_JOURNAL_DTYPE.descr,
+                'map': world.map_cache.map_name,
+                'fixed_delta_seconds': fixed_delta_seconds,
+                'spawn_point': _transform_to_list(world.spawn_point)}
+        with open(path + '.json', 'w') as f:
+            json.dump(meta, f)
+        self._file = open(path, 'wb')
+
+    def record(self, frame, control, light_state):
+        record = self._record[0]
+        record['frame'] = frame
+        record['steer'] = control.steer
+        record['throttle'] = control.throttle
+        record['brake'] = control.brake
+        record['gear'] = control.gear
+        record['hand_brake'] = control.hand_brake
+        record['reverse'] = control.reverse
+        record['manual_gear_shift'] = control.manual_gear_shift
+        record['light_state'] = int(light_state)
+        self._file.write(self._record.tobytes())
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+def load_input_journal(path):
+    """(records, meta) of a journal written by InputJournal."""
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    dtype = np.dtype([tuple(field) for field in meta['dtype']])
+    return np.fromfile(path, dtype=dtype), meta
+
+
+class JournalControl(ScriptedControl):
+    """Replays an InputJournal through parse_events, one record per synchronous tick.
+
+    parse_events returns True once the journal is exhausted, which ends the
+    session like closing the window would.
+    """
+    def __init__(self, world, path, profiler=None):
+        ScriptedControl.__init__(self, world, None, profiler)
+        self._records, self.meta = load_input_journal(path)
+        if not len(self._records):
+            raise ValueError('input journal %s is empty' % path)
+        self._load(world, 0)
+
+    def _load(self, world, index):
+        record = self._records[index]
+        self._control.steer = float(record['steer'])
+        self._control.throttle = float(record['throttle'])
+        self._control.brake = float(record['brake'])
+        self._control.gear = int(record['gear'])
+        self._control.hand_brake = bool(record['hand_brake'])
+        self._control.reverse = bool(record['reverse'])
+        self._control.manual_gear_shift = bool(record['manual_gear_shift'])
+        lights = int(record['light_state'])
+        if lights != self._lights:
+            self._lights = lights
+            world.player.set_light_state(carla.VehicleLightState(lights))
+
+    def parse_events(self, world, clock):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return True
+            elif event.type == pygame.KEYUP and event.key == K_F1:
+                if self._profiler is not None:
+                    self._profiler.toggle_overlay()
+        # 第tick条记录已在本次tick前下发，这里准备下一条
+        self.tick += 1
+        if self.tick >= len(self._records):
+            return True
+        self._load(world, self.tick)
+
+
 # ==============================================================================
 # -- HUD -----------------------------------------------------------------------
 # ==============================================================================
@@ -733,45 +1547,124 @@ class DualControl(object):
 # ==============================================================================
 
 
+COLLISION_RECORD_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('intensity', np.float64),
+    ('other_actor_id', np.int64),
+    ('impulse', np.float32, 3)])
+
+
+class CollisionHistory(object):
+    """Fixed-capacity ring buffer of collision events.
+
+    Per-frame intensity totals are updated on append and eviction, so lookups
+    and windowed sums never rescan the buffer. Events are expected in
+    non-decreasing frame order, which is how CARLA delivers them.
+    """
+    def __init__(self, capacity=4000):
+        self.capacity = capacity
+        self.latest_frame = None
+        self._records = np.zeros(capacity, dtype=COLLISION_RECORD_DTYPE)
+        self._start = 0
+        self._size = 0
+        # frame -> [total intensity, event count], oldest frame first
+        self._per_frame = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, frame):
+        totals = self._per_frame.get(frame)
+        return totals[0] if totals is not None else 0.0
+
+    def append(self, frame, intensity, other_actor_id, impulse):
+        with self._lock:
+            if self._size == self.capacity:
+                self._evict_oldest()
+            index = (self._start + self._size) % self.capacity
+            self._records[index] = (frame, intensity, other_actor_id, impulse)
+            self._size += 1
+            totals = self._per_frame.get(frame)
+            if totals is None:
+                self._per_frame[frame] = [intensity, 1]
+            else:
+                totals[0] += intensity
+                totals[1] += 1
+            self.latest_frame = frame
+
+    def _evict_oldest(self):
+        oldest = self._records[self._start]
+        frame = int(oldest['frame'])
+        totals = self._per_frame[frame]
+        totals[0] -= float(oldest['intensity'])
+        totals[1] -= 1
+        if totals[1] == 0:
+            del self._per_frame[frame]
+        self._start = (self._start + 1) % self.capacity
+        self._size -= 1
+
+    def records(self):
+        """Copy of the stored events, oldest first."""
+        with self._lock:
+            index = (self._start + np.arange(self._size)) % self.capacity
+            return self._records[index]
+
+    def per_frame(self):
+        with self._lock:
+            return collections.OrderedDict((frame, totals[0]) for frame, totals in self._per_frame.items())
+
+    def window(self, last_frames, frame=None):
+        """(event count, total intensity) over the last_frames frames up to frame."""
+        with self._lock:
+            if frame is None:
+                frame = self.latest_frame
+            events, intensity = 0, 0.0
+            if frame is None:
+                return events, intensity
+            first = frame - last_frames
+            for f in reversed(self._per_frame):
+                if f <= first:
+                    break
+                if f <= frame:
+                    totals = self._per_frame[f]
+                    intensity += totals[0]
+                    events += totals[1]
+            return events, intensity
+
+    def total_intensity(self, last_frames, frame=None):
+        return self.window(last_frames, frame)[1]
+
+
 class CollisionSensor(object):
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, events):
         self.sensor = None
-        self.history = []
+        self.history = CollisionHistory(4000)
         self._parent = parent_actor
         # self.hud = hud
         world = self._parent.get_world()
-        bp = world.get_blueprint_library().find('sensor.other.collision')
+        bp = get_map_cache(world).find('sensor.other.collision')
         self.sensor = world.spawn_actor(bp, carla.Transform(), attach_to=self._parent)
-
-        # 0318加载音频文件
-        self.collision_sound = pygame.mixer.Sound("C:\mp3\crash1_volumndowndown.mp3")
+        self.events = events
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
         weak_self = weakref.ref(self)
         self.sensor.listen(lambda event: CollisionSensor._on_collision(weak_self, event))
 
     def get_collision_history(self):
-        history = collections.defaultdict(int)
-        for frame, intensity in self.history:
-            history[frame] += intensity
-        return history
+        # history[frame] gives the summed intensity of that frame, 0.0 if there was none
+        return self.history
 
     @staticmethod
     def _on_collision(weak_self, event):
         self = weak_self()
         if not self:
             return
-        actor_type = get_actor_display_name(event.other_actor)
-        # self.hud.notification('Collision with %r' % actor_type)
+        # self.hud.notification('Collision with %r' % get_actor_display_name(event.other_actor))
         impulse = event.normal_impulse
         intensity = math.sqrt(impulse.x**2 + impulse.y**2 + impulse.z**2)
-        self.history.append((event.frame, intensity))
-        if len(self.history) > 4000:
-            self.history.pop(0)
-        # 0318检查音频是否已经在播放
-        if not pygame.mixer.get_busy():
-            # 0318 播放碰撞音效
-            self.collision_sound.play()
+        self.events.publish(CollisionEvent(event.frame, event.other_actor.id, event.other_actor.type_id,
+                                           intensity, (impulse.x, impulse.y, impulse.z)))
 
 
 # ==============================================================================
@@ -780,12 +1673,13 @@ class CollisionSensor(object):
 
 
 class LaneInvasionSensor(object):
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, events):
         self.sensor = None
         self._parent = parent_actor
+        self.events = events
         # self.hud = hud
         world = self._parent.get_world()
-        bp = world.get_blueprint_library().find('sensor.other.lane_invasion')
+        bp = get_map_cache(world).find('sensor.other.lane_invasion')
         self.sensor = world.spawn_actor(bp, carla.Transform(), attach_to=self._parent)
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
@@ -797,9 +1691,8 @@ class LaneInvasionSensor(object):
         self = weak_self()
         if not self:
             return
-        lane_types = set(x.type for x in event.crossed_lane_markings)
-        text = ['%r' % str(x).split()[-1] for x in lane_types]
-        # self.hud.notification('Crossed line %s' % ' and '.join(text))
+        lane_types = tuple(set(x.type for x in event.crossed_lane_markings))
+        self.events.publish(InvasionEvent(event.frame, lane_types))
 
 # ==============================================================================
 # -- GnssSensor --------------------------------------------------------
@@ -807,13 +1700,14 @@ class LaneInvasionSensor(object):
 
 
 class GnssSensor(object):
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, events):
         self.sensor = None
         self._parent = parent_actor
+        self.events = events
         self.lat = 0.0
         self.lon = 0.0
         world = self._parent.get_world()
-        bp = world.get_blueprint_library().find('sensor.other.gnss')
+        bp = get_map_cache(world).find('sensor.other.gnss')
         self.sensor = world.spawn_actor(bp, carla.Transform(carla.Location(x=1.0, z=2.8)), attach_to=self._parent)
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
@@ -825,8 +1719,7 @@ class GnssSensor(object):
         self = weak_self()
         if not self:
             return
-        self.lat = event.latitude
-        self.lon = event.longitude
+        self.events.publish(GnssEvent(event.frame, event.latitude, event.longitude))
 
 
 # ==============================================================================
@@ -934,6 +1827,169 @@ class GnssSensor(object):
 #             image.save_to_disk('_out/%08d' % image.frame)
 
 
+# ==============================================================================
+# -- FrameConverter ------------------------------------------------------------
+# ==============================================================================
+
+
+class FrameConverter(object):
+    """Copies CARLA BGRA camera frames into preallocated pygame surfaces.
+
+    The surfaces use a 32 bit XRGB layout, which on little-endian machines has
+    the same byte order as CARLA's BGRA buffers, so the channel swap is free and
+    the mirror is folded into the single copy made for every frame.
+    """
+    MASKS = (0xFF0000, 0xFF00, 0xFF, 0)
+
+    def __init__(self, width, height, mirror=False):
+        self.width = width
+        self.height = height
+        self.mirror = mirror
+        self._native = sys.byteorder == 'little'
+        # Two surfaces so the callback thread never writes the one being blitted.
+        self._surfaces = [pygame.Surface((width, height), 0, 32, self.MASKS) for _ in range(2)]
+        self._index = 0
+
+    def convert(self, raw_data):
+        bgra = np.frombuffer(raw_data, dtype=np.dtype("uint8")).reshape(self.height, self.width, 4)
+        self._index ^= 1
+        surface = self._surfaces[self._index]
+        if self._native:
+            src = bgra.view(np.uint32)[:, :, 0]
+            if self.mirror:
+                src = src[:, ::-1]
+            pixels = np.asarray(surface.get_view('2'))
+            np.copyto(pixels, src.T)
+        else:
+            src = bgra[:, :, 2::-1]
+            if self.mirror:
+                src = src[:, ::-1]
+            pixels = pygame.surfarray.pixels3d(surface)
+            np.copyto(pixels, src.swapaxes(0, 1))
+        # Release the pixel view so the surface is unlocked before it is blitted.
+        del pixels
+        return surface
+
+
+class FrameDecoder(object):
+    """Decodes camera frames for SensorManager on a bounded thread pool.
+
+    Each sensor has at most one frame being decoded and one waiting. With the
+    'latest' policy a newer frame replaces the waiting one, 'skip' drops frames
+    that arrive while the sensor is busy, and 'block' holds the CARLA callback
+    thread until the sensor is free again.
+    """
+    POLICIES = ('latest', 'skip', 'block')
+
+    def __init__(self, workers=2, policy='latest'):
+        if policy not in self.POLICIES:
+            raise ValueError('unknown decode policy %r' % policy)
+        self.policy = policy
+        self.submitted = 0
+        self.decoded = 0
+        self.failed = 0
+        self.dropped = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # 忙碌标记和待解码帧必须一起更新，否则worker刚退出时新帧会既不排队也不提交
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._busy = set()
+        self._pending = {}
+
+    def submit(self, sensor, image):
+        key = id(sensor)
+        with self._lock:
+            self.submitted += 1
+            if key in self._busy:
+                if self.policy == 'latest':
+                    if key in self._pending:
+                        self.dropped += 1
+                    self._pending[key] = image
+                    return
+                if self.policy == 'skip':
+                    self.dropped += 1
+                    return
+                while key in self._busy:
+                    self._idle.wait()
+            self._busy.add(key)
+        self._executor.submit(self._run, sensor, image)
+
+    def _run(self, sensor, image):
+        key = id(sensor)
+        while image is not None:
+            try:
+                sensor.decode_image(image)
+                decoded = True
+            except Exception:
+                logging.exception('decoding frame %s failed', getattr(image, 'frame', None))
+                decoded = False
+            with self._lock:
+                if decoded:
+                    self.decoded += 1
+                else:
+                    self.failed += 1
+                image = self._pending.pop(key, None)
+                if image is None:
+                    self._busy.discard(key)
+                    self._idle.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {'submitted': self.submitted, 'decoded': self.decoded, 'failed': self.failed,
+                    'dropped': self.dropped}
+
+    def shutdown(self):
+        with self._lock:
+            self.dropped += len(self._pending)
+            self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+
+def benchmark_frame_conversion(width, height, cameras=6, frames=100):
+    """Feeds synthetic BGRA buffers through FrameConverter, no server needed."""
+    pygame.init()
+    timer = CustomTimer()
+    buffers = [np.random.randint(0, 256, (height, width, 4), dtype=np.uint8).tobytes()
+               for _ in range(cameras)]
+    results = []
+    for mirror in (False, True):
+        converters = [FrameConverter(width, height, mirror) for _ in range(cameras)]
+        t_start = timer.time()
+        for _ in range(frames):
+            for converter, raw_data in zip(converters, buffers):
+                converter.convert(raw_data)
+        ms = 1000.0 * (timer.time() - t_start) / (frames * cameras)
+        results.append((mirror, ms))
+        print('%dx%d x%d cameras, mirror=%-5s %8.3f ms/frame' % (width, height, cameras, mirror, ms))
+    return results
+
+
+def peak_memory_mb():
+    """Peak resident set size of this process, None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def benchmark_report(profiler, ticks, seconds, events=None):
+    report = collections.OrderedDict([
+        ('ticks', ticks),
+        ('seconds', seconds),
+        ('ticks_per_second', ticks / seconds if seconds > 0 else 0.0),
+        ('peak_rss_mb', peak_memory_mb()),
+        ('stages', profiler.summary()),
+        ('sensor_events', events.stats() if events is not None else None)])
+    print('%d ticks in %.2f s: %.1f ticks/s, peak RSS %s MB' % (
+        ticks, seconds, report['ticks_per_second'],
+        '%.1f' % report['peak_rss_mb'] if report['peak_rss_mb'] is not None else 'n/a'))
+    print('%-18s %8s %8s %8s %8s' % ('stage [ms]', 'mean', 'p50', 'p95', 'p99'))
+    for stage, stats in report['stages'].items():
+        print('%-18s %8.2f %8.2f %8.2f %8.2f' % (stage, stats['mean'], stats['p50'], stats['p95'], stats['p99']))
+    return report
+
+
 # =====================
 # -- SensorManager --
 # =======================
@@ -944,19 +2000,27 @@ class SensorManager:
         self.world = world
         self.display_man = display_man
         self.display_pos = display_pos
-        self.sensor = self.init_sensor(sensor_type, transform, attached, sensor_options)
-        self.sensor_options = sensor_options
+        self.reverse = reverse
+        self.frame_converter = None
         self.timer = CustomTimer()
         self.time_processing = 0.0
         self.tics_processing = 0
+        self.sensor = self.init_sensor(sensor_type, transform, attached, sensor_options)
+        self.sensor_options = sensor_options
         self.display_man.add_sensor(self)
-        self.reverse = reverse
         self.overlay_position = overlay_position  # 新增悬浮窗口位置属性
         self.overlay_size = overlay_size
         self.mask_path = mask_path
+        self.frame_id = None
+        self.sequence = 0
+        self._rendered_sequence = 0
+        self._composite = None
+        self._overlay_target_size = None
+        self._resized_surface = None
+        self._masked_surface = None
     def init_sensor(self, sensor_type, transform, attached, sensor_options):
         if sensor_type == 'RGBCamera':
-            camera_bp = self.world.get_blueprint_library().find('sensor.camera.rgb')
+            camera_bp = get_map_cache(self.world).find('sensor.camera.rgb')
             disp_size = self.display_man.get_display_size()
             print("===size:", str(disp_size[0]), str(disp_size[1]))
             camera_bp.set_attribute('image_size_x', str(disp_size[0]))
@@ -976,28 +2040,42 @@ class SensorManager:
     def get_sensor(self):
         return self.sensor
     def save_rgb_image(self, image):
+        decoder = self.display_man.decoder
+        if decoder is not None:
+            decoder.submit(self, image)
+        else:
+            self.decode_image(image)
+
+    def decode_image(self, image):
         t_start = self.timer.time()
-        image.convert(carla.ColorConverter.Raw)
-        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-        array = np.reshape(array, (image.height, image.width, 4))
-        array = array[:, :, :3]
-        array = array[:, :, ::-1]
-        if self.reverse == True:
-            array = np.flip(array, axis=1)  # 将画面左右翻转
         if self.display_man.render_enabled():
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
+            converter = self.frame_converter
+            if converter is None or (converter.width, converter.height) != (image.width, image.height):
+                # reverse为True时将画面左右翻转
+                converter = FrameConverter(image.width, image.height, mirror=self.reverse)
+                self.frame_converter = converter
+            # 先发布画面再增加序号，主线程看到新序号时画面一定已经就绪
+            self.surface = converter.convert(image.raw_data)
+            self.frame_id = image.frame
+            self.sequence += 1
         t_end = self.timer.time()
         self.time_processing += (t_end - t_start)
         self.tics_processing += 1
 
+    def _overlay_targets(self):
+        # Target surfaces are reused every frame and rebuilt only when the overlay size changes.
+        size = tuple(self.overlay_size)
+        if self._overlay_target_size != size:
+            self._resized_surface = pygame.Surface(size, 0, 32, FrameConverter.MASKS)
+            self._masked_surface = pygame.Surface(size, pygame.SRCALPHA) if self.mask_path else None
+            self._overlay_target_size = size
+        return self._resized_surface, self._masked_surface
+
     def apply_mask(self, surface):
         if self.mask_path:
-            # 加载遮罩图像
-            mask_image = pygame.image.load(self.mask_path).convert_alpha()
-            # 调整遮罩图像大小以匹配悬浮窗口大小
-            mask_image = pygame.transform.scale(mask_image, self.overlay_size)
-            # 创建一个新Surface以应用遮罩
-            masked_surface = pygame.Surface(self.overlay_size, pygame.SRCALPHA)
+            # 遮罩图像只加载并缩放一次，大小与悬浮窗口一致
+            mask_image = self.display_man.mask_cache.get(self.mask_path, self.overlay_size)
+            masked_surface = self._overlay_targets()[1]
             # 应用遮罩
             masked_surface.blit(surface, (0, 0))
             masked_surface.blit(mask_image, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
@@ -1005,25 +2083,46 @@ class SensorManager:
         else:
             return surface
 
+    def get_rect(self):
+        if self.overlay_position is not None and self.overlay_size:
+            return pygame.Rect(self.overlay_position, self.overlay_size)
+        if self.overlay_position is not None:
+            position = self.overlay_position
+        else:
+            position = self.display_man.get_display_offset(self.display_pos)
+        size = self.surface.get_size() if self.surface is not None else self.display_man.get_display_size()
+        return pygame.Rect(position, size)
+
     # 遮罩后的后视镜
-    def render(self):
-        if self.surface is not None:
+    def render(self, force=False):
+        """Blits the latest frame, returns the dirty rect or None if nothing was drawn."""
+        if self.surface is None:
+            return None
+        sequence = self.sequence
+        if sequence != self._rendered_sequence:
+            # 只有新的画面才需要缩放和遮罩
+            self._rendered_sequence = sequence
             if self.overlay_position is not None:
-                resized_surface = pygame.transform.scale(self.surface,
-                                                         self.overlay_size) if self.overlay_size else self.surface
+                if self.overlay_size:
+                    resized_surface = pygame.transform.scale(self.surface, self.overlay_size,
+                                                             self._overlay_targets()[0])
+                else:
+                    resized_surface = self.surface
 
                 # 应用遮罩
-                masked_surface = self.apply_mask(resized_surface)
-                # 绘制遮罩后的图像
-                self.display_man.display.blit(masked_surface, self.overlay_position)
-
-                # # Draw a red border around the overlay
-                # border_color = (255, 0, 0)  # Red color
-                # border_rect = pygame.Rect(self.overlay_position, self.overlay_size)  # Create a Rect for the border
-                # pygame.draw.rect(self.display_man.display, border_color, border_rect, 3)  # 3 is the border thickness
+                self._composite = self.apply_mask(resized_surface)
             else:
-                offset = self.display_man.get_display_offset(self.display_pos)
-                self.display_man.display.blit(self.surface, offset)
+                self._composite = self.surface
+        elif not force:
+            return None
+        rect = self.get_rect()
+        # 绘制遮罩后的图像
+        self.display_man.display.blit(self._composite, rect)
+        # # Draw a red border around the overlay
+        # border_color = (255, 0, 0)  # Red color
+        # border_rect = pygame.Rect(self.overlay_position, self.overlay_size)  # Create a Rect for the border
+        # pygame.draw.rect(self.display_man.display, border_color, border_rect, 3)  # 3 is the border thickness
+        return rect
 
     # def render(self):
     #     if self.surface is not None:
@@ -1072,22 +2171,177 @@ class SensorManager:
         self.sensor.destroy()
 
 
+# ==============================================================================
+# -- TelemetryRecorder ---------------------------------------------------------
+# ==============================================================================
+
+
+TELEMETRY_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('timestamp', np.float64),
+    ('location', np.float32, 3),
+    ('rotation', np.float32, 3),        # pitch, yaw, roll
+    ('velocity', np.float32, 3),
+    ('acceleration', np.float32, 3),
+    ('throttle', np.float32),
+    ('steer', np.float32),
+    ('brake', np.float32),
+    ('hand_brake', np.bool_),
+    ('reverse', np.bool_),
+    ('manual_gear_shift', np.bool_),
+    ('gear', np.int32),
+    ('light_state', np.uint32),
+    ('latitude', np.float64),
+    ('longitude', np.float64),
+    ('radar_proximity', np.float32),
+    ('radar_ttc', np.float32)])
+
+
+def load_telemetry(path):
+    """Memory-maps a telemetry file written by TelemetryRecorder, read-only."""
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    dtype = np.dtype([tuple(field) for field in meta['dtype']])
+    if meta['count'] == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(meta['count'],))
+
+
+class TelemetryRecorder(object):
+    """Appends one fixed-size TELEMETRY_DTYPE record per synchronous tick to a memory-mapped file.
+
+    The main thread only writes into the mapping; a background thread flushes
+    it to disk and keeps the '<path>.json' sidecar (dtype and record count) up
+    to date, so the file can be opened with load_telemetry() at any time.
+    """
+    def __init__(self, path, capacity=20 * 3600, flush_interval=1.0):
+        self.path = path
+        self.count = 0
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        with open(path, 'wb') as f:
+            f.truncate(capacity * TELEMETRY_DTYPE.itemsize)
+        self._records = np.memmap(path, dtype=TELEMETRY_DTYPE, mode='r+', shape=(capacity,))
+        self._write_meta()
+        self._stop = threading.Event()
+        self._flush_interval = flush_interval
+        self._thread = threading.Thread(target=self._flush_loop, name='telemetry-flush')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _grow(self):
+        # Double the file and remap it, the records written so far stay in place.
+        # The mapping is released first, as close() does, because Windows cannot
+        # resize a file that is still mapped.
+        self._records.flush()
+        del self._records
+        self._capacity *= 2
+        with open(self.path, 'r+b') as f:
+            f.truncate(self._capacity * TELEMETRY_DTYPE.itemsize)
+        self._records = np.memmap(self.path, dtype=TELEMETRY_DTYPE, mode='r+', shape=(self._capacity,))
+
+    def capture(self, world, controller):
+        state = world.state
+        hero = state.find(world.player.id)
+        if hero is None:
+            return
+        transform = hero.get_transform()
+        velocity = hero.get_velocity()
+        acceleration = hero.get_acceleration()
+        control = controller.get_control(world)
+        with self._lock:
+            if self.count == self._capacity:
+                self._grow()
+            record = self._records[self.count]
+            record['frame'] = state.frame
+            record['timestamp'] = state.elapsed_seconds
+            record['location'] = (transform.location.x, transform.location.y, transform.location.z)
+            record['rotation'] = (transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+            record['velocity'] = (velocity.x, velocity.y, velocity.z)
+            record['acceleration'] = (acceleration.x, acceleration.y, acceleration.z)
+            record['throttle'] = control.throttle
+            record['steer'] = control.steer
+            record['brake'] = control.brake
+            record['hand_brake'] = control.hand_brake
+            record['reverse'] = control.reverse
+            record['manual_gear_shift'] = control.manual_gear_shift
+            record['gear'] = control.gear
+            record['light_state'] = int(controller.get_light_state())
+            record['latitude'] = world.gnss_sensor.lat
+            record['longitude'] = world.gnss_sensor.lon
+            record['radar_proximity'] = world.radar_proximity
+            record['radar_ttc'] = world.radar_ttc
+            self.count += 1
+
+    def _write_meta(self):
+        meta = {'dtype': [(name,) + ((TELEMETRY_DTYPE[name].base.str, TELEMETRY_DTYPE[name].shape)
+                                     if TELEMETRY_DTYPE[name].shape else (TELEMETRY_DTYPE[name].str,))
+                          for name in TELEMETRY_DTYPE.names],
+                'count': self.count}
+        with open(self.path + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+
+    def flush(self):
+        with self._lock:
+            self._records.flush()
+            self._write_meta()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            # Drop the unused preallocated tail so the file holds exactly count records.
+            self._records.flush()
+            del self._records
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.count * TELEMETRY_DTYPE.itemsize)
+            self._write_meta()
+
+
 # ======================
 # -- cluster --
 # ======================
 
-# 创建字体对象用于绘制文本
+class HudText(object):
+    """Fonts loaded once per size and rendered text cached by (text, size, color)."""
+    def __init__(self, font_path=None, max_entries=256):
+        self.font_path = font_path or pygame.font.get_default_font()
+        self.max_entries = max_entries
+        self._fonts = {}
+        self._surfaces = collections.OrderedDict()
+
+    def font(self, size):
+        font = self._fonts.get(size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.Font(self.font_path, size)
+        return font
+
+    def render(self, text, size, color):
+        key = (text, size, tuple(color))
+        text_surface = self._surfaces.get(key)
+        if text_surface is None:
+            text_surface = self.font(size).render(text, True, color)
+            self._surfaces[key] = text_surface
+            if len(self._surfaces) > self.max_entries:
+                # Changing values such as speed must not grow the cache forever.
+                self._surfaces.popitem(last=False)
+        else:
+            self._surfaces.move_to_end(key)
+        return text_surface
+
+
+# 字体在HudText中只创建一次，档位来自本地的VehicleControl，不再每帧请求服务器
 
-def draw_reverse_indicator(surface, vehicle):
-    font = pygame.font.Font(pygame.font.get_default_font(), 100)
-    font_name = 'courier' if os.name == 'nt' else 'mono'
-    fonts = [x for x in pygame.font.get_fonts() if font_name in x]
-    default_font = 'ubuntumono'
+def draw_reverse_indicator(surface, control, hud_text):
     # 检查车辆是否在倒挡
-    reverse = vehicle.get_control().reverse
-    if reverse:
+    if control.reverse:
         # 创建包含字母"R"的表面
-        text_surface = font.render('R', True, (255, 0, 0))  # 红色字母"R"
+        text_surface = hud_text.render('R', 100, (255, 0, 0))  # 红色字母"R"
         # 获取屏幕尺寸以便正确放置文本
         screen_rect = surface.get_rect()
         # 定位到屏幕左下角
@@ -1095,6 +2349,8 @@ def draw_reverse_indicator(surface, vehicle):
         # 绘制文本
         surface.blit(text_surface, text_rect)
         # print("draw R font")
+        return text_rect
+    return None
 
 
 # ==============================================================================
@@ -1107,10 +2363,21 @@ def game_loop(args):
     pygame.font.init()
     world = None
     display_manager = None
+    controller = None
+    profiler = None
+    telemetry = None
+    journal = None
+    replay_meta = None
+    audio = None
+    recording = not args.benchmark_ticks
     timer = CustomTimer()
     try:
         client = carla.Client(args.host, args.port)
-        client.load_world('Town03')  #20240207加的 可用：10HD/03/
+        if args.replay_journal:
+            replay_meta = load_input_journal(args.replay_journal)[1]
+            client.load_world(replay_meta['map'])
+        else:
+            client.load_world('Town03')  #20240207加的 可用：10HD/03/
         client.set_timeout(2.0)
 
         display = pygame.display.set_mode(
@@ -1118,7 +2385,10 @@ def game_loop(args):
             pygame.HWSURFACE | pygame.DOUBLEBUF)     # 定义display
 
         # hud = HUD(args.width, args.height)
-        world = World(client.get_world(), args.filter)
+        # 所有音效在启动时一次解码好
+        audio = AudioBank(args.audio_dir, enabled=not args.headless)
+        world = World(client.get_world(), args.filter,
+                      _transform_from_list(replay_meta['spawn_point']) if replay_meta else None, audio)
 
         # 设置同步模式
         settings = world.world.get_settings()
@@ -1126,69 +2396,123 @@ def game_loop(args):
         # settings.no_rendering_mode = True          # 0326
 
         settings.synchronous_mode = True  # 启用同步模式
-        settings.fixed_delta_seconds = 0.05  # 每个仿真步骤的时间间隔
+        settings.fixed_delta_seconds = replay_meta['fixed_delta_seconds'] if replay_meta else 0.05  # 每个仿真步骤的时间间隔
         world.world.apply_settings(settings)
 
-        controller = DualControl(world, args.autopilot)
+        profiler = FrameProfiler(window=max(1200, args.benchmark_ticks),
+                                 dump_path=args.profile_dump, dump_interval=args.profile_interval)
+        if args.replay_journal:
+            controller = JournalControl(world, args.replay_journal, profiler)
+        elif args.headless or args.input_script:
+            # 无方向盘：按脚本或回放的控制量驾驶
+            controller = ScriptedControl(world, args.input_script, profiler)
+        else:
+            controller = DualControl(world, args.autopilot, profiler, args.wheel_config, args.input_profile,
+                                     args.late_input, args.input_cutoff)
         hero = world.player
+        hud_text = HudText()
 
         # Display Manager organize all the sensors an its display in a window
         # If can easily configure the grid and the total window size
         # grid_size中第一个元素表示网格的行数，第二个元素代表网格的列数。
-        display_manager = DisplayManager(grid_size=[1, 3], window_size=[args.width, args.height])
+        decoder = FrameDecoder(args.decode_workers, args.decode_policy) if args.decode_workers > 0 else None
+        display_manager = DisplayManager(grid_size=[1, 3], window_size=[args.width, args.height], decoder=decoder)
 
 
         # Example for adding overlay positions for rear-view cameras
         # overlay_positions = [(1100, 800), (3500, 150), (5150, 720)] # 示例悬浮位置
         overlay_positions = [(780, 563), (2450, 100), (3650, 510)]
         rearview_sizes = [(280,170),(475,126),(190,130)]
+        mask_paths = ["C:\mask\mask1.png", "C:\mask\mask2.png", "C:\mask\mask3.png"]
+        if args.headless:
+            # 无界面运行时遮罩文件不一定存在，缺失时后视镜不加遮罩
+            mask_paths = [path if os.path.exists(path) else None for path in mask_paths]
 
-        SensorManager(client.get_world(), display_manager, 'RGBCamera',
+        SensorManager(world.world, display_manager, 'RGBCamera',
                       carla.Transform(carla.Location(x=-0.32, y=-0.25, z=1.3), carla.Rotation(pitch=-2,yaw=-40)),
                       hero, {}, display_pos=[0, 0], reverse=False)
-        SensorManager(client.get_world(), display_manager, 'RGBCamera',
+        SensorManager(world.world, display_manager, 'RGBCamera',
                       carla.Transform(carla.Location(x=-0.32, y=-0.25, z=1.3), carla.Rotation(pitch=-2,yaw=+00)),
                       hero, {}, display_pos=[0, 1], reverse=False)
-        SensorManager(client.get_world(), display_manager, 'RGBCamera',
+        SensorManager(world.world, display_manager, 'RGBCamera',
                       carla.Transform(carla.Location(x=-0.32, y=-0.25, z=1.3), carla.Rotation(pitch=-2,yaw=+40)),
                       hero, {}, display_pos=[0, 2], reverse=False)
 
-        SensorManager(client.get_world(), display_manager, 'RGBCamera',
+        SensorManager(world.world, display_manager, 'RGBCamera',
                       carla.Transform(carla.Location(x=0.7, y=-1.0, z=1.1), carla.Rotation(yaw=-170)),
-                      hero, {}, display_pos=[1, 0], reverse=True, overlay_position = overlay_positions[0],overlay_size= rearview_sizes[0],mask_path="C:\mask\mask1.png")
-        SensorManager(client.get_world(), display_manager, 'RGBCamera',
+                      hero, {}, display_pos=[1, 0], reverse=True, overlay_position = overlay_positions[0],overlay_size= rearview_sizes[0],mask_path=mask_paths[0])
+        SensorManager(world.world, display_manager, 'RGBCamera',
                       carla.Transform(carla.Location(x=0.7, y=0, z=1.3), carla.Rotation(yaw=-180)),
-                      hero, {}, display_pos=[1, 1], reverse=True, overlay_position = overlay_positions[1],overlay_size= rearview_sizes[1],mask_path="C:\mask\mask2.png")
-        SensorManager(client.get_world(), display_manager, 'RGBCamera',
+                      hero, {}, display_pos=[1, 1], reverse=True, overlay_position = overlay_positions[1],overlay_size= rearview_sizes[1],mask_path=mask_paths[1])
+        SensorManager(world.world, display_manager, 'RGBCamera',
                       carla.Transform(carla.Location(x=0.7, y=+1.0, z=1.1), carla.Rotation(yaw=+170)),
-                      hero, {}, display_pos=[1, 2], reverse=True, overlay_position = overlay_positions[2],overlay_size= rearview_sizes[2],mask_path="C:\mask\mask3.png")
+                      hero, {}, display_pos=[1, 2], reverse=True, overlay_position = overlay_positions[2],overlay_size= rearview_sizes[2],mask_path=mask_paths[2])
 
         clock = pygame.time.Clock()
         # list_available_vehicles(world.world)
 
         # record
         # print("Recording on file: %s" % client.start_recorder(args.recorder_filename))
-        print("Recording on file: %s,with additional data:%s" % (args.recorder_filename,True))
-        client.start_recorder(args.recorder_filename,True)
-        if (args.recorder_time > 0):
-            time.sleep(args.recorder_time)
-
-        while True:
+        if recording:
+            print("Recording on file: %s,with additional data:%s" % (args.recorder_filename,True))
+            client.start_recorder(args.recorder_filename,True)
+            if (args.recorder_time > 0):
+                time.sleep(args.recorder_time)
+
+        if args.telemetry:
+            telemetry = TelemetryRecorder(args.telemetry)
+            print("Telemetry on file: %s" % args.telemetry)
+
+        if args.input_journal:
+            journal = InputJournal(args.input_journal, world, settings.fixed_delta_seconds)
+            print("Input journal on file: %s" % args.input_journal)
+
+        t_start = timer.time()
+        while not args.benchmark_ticks or profiler.ticks < args.benchmark_ticks:
             # clock.tick_busy_loop(60)
 
+            profiler.begin_tick()
+            # 控制量在tick之前才下发，方向盘输入到生效之间不再隔着渲染时间
+            controller.apply_control(world)
             # sync添加
             world.world.tick()
+            world.state.refresh(world.world)
+            profiler.lap('world_tick')
+            # 每个tick集中处理一次传感器事件
+            world.events.dispatch()
+            profiler.lap('sensor_events')
+            if journal is not None:
+                journal.record(world.state.frame, controller.get_control(world), controller.get_light_state())
+            if telemetry is not None:
+                telemetry.capture(world, controller)
+                profiler.lap('telemetry')
 
             if controller.parse_events(world, clock):
                 return
+            profiler.lap('parse_events')
             # world.tick(clock)
 
             # world.render(display)   # 0308修改：打开了world.render(display),出现了最开始example的驾驶员视角.但不行，反应太慢。
             # pygame.display.flip()  # 更新屏幕
 
             display_manager.render()   # 0308修改：把display_manager.render()放到world.render(display)之后，出现后视镜
-            draw_reverse_indicator(display, hero)
-            pygame.display.flip()  # 更新屏幕
+            profiler.lap('display_render')
+            reverse_rect = draw_reverse_indicator(display, controller.get_control(world), hud_text)
+            profiler.lap('reverse_indicator')
+            profiler_rect = profiler.render(display)
+            # 下一帧重绘"R"和统计表下面的摄像头画面，关闭后才会被擦掉
+            for rect in (reverse_rect, profiler_rect):
+                if rect is not None:
+                    display_manager.invalidate(rect)
+            display_manager.present([reverse_rect, profiler_rect])  # 只更新有变化的区域
+            profiler.lap('present')
+            profiler.end_tick(display_manager.get_sensor_list())
+
+        if args.benchmark_ticks:
+            report = benchmark_report(profiler, profiler.ticks, timer.time() - t_start, world.events)
+            if args.benchmark_report:
+                with open(args.benchmark_report, 'w') as f:
+                    json.dump(report, f, indent=2)
 
     finally:
         if world is not None:
@@ -1198,14 +2522,37 @@ def game_loop(args):
             settings.fixed_delta_seconds = None
             world.world.apply_settings(settings)
 
+        if profiler is not None and profiler.dump_path:
+            profiler.dump()
+
+        if telemetry is not None:
+            telemetry.close()
+            print("Telemetry records: %d" % telemetry.count)
+
+        if journal is not None:
+            journal.close()
+            print("Input journal records: %d" % journal.count)
+
+        if controller is not None:
+            controller.destroy()
+            if controller.input_stats():
+                print("input sampling [ms]:", json.dumps(controller.input_stats()))
+
         if display_manager:
             display_manager.destroy()
+            if display_manager.decoder is not None:
+                print("decoded frames:", display_manager.decoder.stats())
         if world is not None:
             world.destroy()
+            print("sensor events:", json.dumps(world.events.stats()))
         print("world destroyed")
 
-        print("Stop recording")
-        client.stop_recorder()
+        if recording:
+            print("Stop recording")
+            client.stop_recorder()
+
+        if audio is not None:
+            audio.close()
 
         pygame.quit()   # 退出pygame
 
@@ -1270,6 +2617,95 @@ def main():
         default=0,
         type=int,
         help='recorder duration (auto-stop)')
+    argparser.add_argument(
+        '--wheel_config',
+        metavar='PATH',
+        default=WHEEL_CONFIG,
+        help='wheel_config.ini with axis indices, response curves and profiles')
+    argparser.add_argument(
+        '--input_profile',
+        metavar='NAME',
+        default=None,
+        help='use the [profile NAME] section of the wheel config (default: its profile key, if any)')
+    argparser.add_argument(
+        '--late_input',
+        action='store_true',
+        help='re-read the wheel right before each tick and print input latency statistics on exit')
+    argparser.add_argument(
+        '--input_cutoff',
+        metavar='HZ',
+        default=0.0,
+        type=float,
+        help='low-pass cutoff for the late-read steering and pedals, 0 disables it (default: 0)')
+    argparser.add_argument(
+        '--audio_dir',
+        metavar='DIR',
+        default=AUDIO_DIR,
+        help='directory with the sound cues (default: %s)' % AUDIO_DIR)
+    argparser.add_argument(
+        '--input_journal',
+        metavar='PATH',
+        default=None,
+        help='record the control of every tick to PATH for --replay_journal')
+    argparser.add_argument(
+        '--replay_journal',
+        metavar='PATH',
+        default=None,
+        help='drive by replaying an input journal from its recorded map and spawn point, then exit')
+    argparser.add_argument(
+        '--telemetry',
+        metavar='PATH',
+        default=None,
+        help='write hero telemetry for every tick to PATH (binary, load with load_telemetry)')
+    argparser.add_argument(
+        '--profile_dump',
+        metavar='PATH',
+        default=None,
+        help='append per-stage frame time percentiles to PATH (.csv, otherwise JSON lines); F1 toggles the overlay')
+    argparser.add_argument(
+        '--profile_interval',
+        metavar='SECONDS',
+        default=10.0,
+        type=float,
+        help='seconds between profile dumps (default: 10)')
+    argparser.add_argument(
+        '--decode_workers',
+        metavar='N',
+        default=0,
+        type=int,
+        help='decode camera frames on N worker threads (default: 0, decode in the sensor callback)')
+    argparser.add_argument(
+        '--decode_policy',
+        choices=FrameDecoder.POLICIES,
+        default='latest',
+        help='what to do with frames that arrive while a camera is still decoding (default: latest)')
+    argparser.add_argument(
+        '--headless',
+        action='store_true',
+        help='no window, joystick or audio (dummy SDL drivers); drive with --input_script')
+    argparser.add_argument(
+        '--input_script',
+        metavar='PATH',
+        default=None,
+        help='drive from a control script: CSV with tick,throttle,steer,brake,hand_brake,reverse '
+             'or a --telemetry file to replay (default with --headless: a slalom)')
+    argparser.add_argument(
+        '--benchmark_ticks',
+        metavar='N',
+        default=0,
+        type=int,
+        help='run N synchronous ticks without recording, then print ticks/s, stage latencies and memory')
+    argparser.add_argument(
+        '--benchmark_report',
+        metavar='PATH',
+        default=None,
+        help='also write the --benchmark_ticks report to PATH as JSON')
+    argparser.add_argument(
+        '--benchmark_frames',
+        metavar='N',
+        default=0,
+        type=int,
+        help='convert N synthetic frames per camera at --res and exit, no server needed')
 
     args = argparser.parse_args()
 
@@ -1280,6 +2716,15 @@ def main():
 
     logging.info('listening to server %s:%s', args.host, args.port)
 
+    if args.headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+    if args.benchmark_frames > 0:
+        # Each camera covers one cell of the 1x3 display grid used in game_loop.
+        benchmark_frame_conversion(int(args.width / 3), args.height, frames=args.benchmark_frames)
+        return
+
     print(__doc__)
 
     try:
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Summarises many recordings in parallel and merges the results in one report.
+
+Recordings come from glob patterns and/or a manifest file with one name per
+line. Each one is decoded by a CARLA server picked round-robin from the
+--host/--port lists, on a pool of worker processes. Names ending in .txt are
+treated as saved show_recorder_file_info dumps and parsed locally.
+
+  python batch_recorder_analysis.py -r "P*.log" --host 10.0.0.1 10.0.0.2 -o cohort.csv
+"""
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import json
+import math
+
+from recorder_parser import RecorderTextParser
+from recorder_parser import iter_file_lines
+from recorder_parser import iter_text_lines
+
+SUMMARY_FIELDS = [
+    'recording', 'endpoint', 'map', 'date', 'frames', 'duration', 'actors_created', 'collisions',
+    'hero_ids', 'hero_collisions', 'first_hero_collision_time', 'hero_max_speed', 'hero_mean_speed',
+    'hero_max_acceleration', 'hero_mean_throttle', 'hero_mean_brake', 'error']
+
+
+def list_recordings(patterns, manifest):
+    recordings = []
+    for pattern in patterns or []:
+        # Names that match nothing locally are assumed to live on the server.
+        recordings.extend(sorted(glob.glob(pattern)) or [pattern])
+    if manifest:
+        with open(manifest) as f:
+            recordings.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return recordings
+
+
+def summarize(records, parser):
+    """Folds (table, record) pairs into one summary without keeping the records."""
+    summary = dict((field, '') for field in SUMMARY_FIELDS)
+    frames = 0
+    time = 0.0
+    created = 0
+    collisions = []
+    speed = collections.defaultdict(lambda: [0.0, 0.0, 0])        # id -> max, sum, count
+    acceleration = collections.defaultdict(float)
+    controls = collections.defaultdict(lambda: [0.0, 0.0, 0])     # id -> throttle sum, brake sum, count
+    for table, record in records:
+        if table == 'frames':
+            frames += 1
+            time = record[1]
+        elif table == 'events':
+            created += record[1] == 'create'
+        elif table == 'collisions':
+            collisions.append((time, record))
+        elif table == 'kinematics':
+            v = math.sqrt(record[2] ** 2 + record[3] ** 2 + record[4] ** 2)
+            a = math.sqrt(record[8] ** 2 + record[9] ** 2 + record[10] ** 2)
+            stats = speed[record[1]]
+            stats[0] = max(stats[0], v)
+            stats[1] += v
+            stats[2] += 1
+            acceleration[record[1]] = max(acceleration[record[1]], a)
+        elif table == 'controls':
+            stats = controls[record[1]]
+            stats[0] += record[3]
+            stats[1] += record[4]
+            stats[2] += 1
+    # Without show_all only frames with events are printed, so the totals
+    # come from the trailer and the frame count is only a fallback.
+    if 'frames' in parser.info:
+        frames = int(parser.info['frames'])
+    duration = float(parser.info['duration'].split()[0]) if 'duration' in parser.info else time
+    heroes = parser.hero_ids
+    hero_collisions = [(t, c) for t, c in collisions
+                       if c[4] or c[5] or c[2] in heroes or c[3] in heroes]
+    summary.update({
+        'map': parser.info.get('map', ''),
+        'date': parser.info.get('date', ''),
+        'frames': frames,
+        'duration': duration,
+        'actors_created': created,
+        'collisions': len(collisions),
+        'hero_ids': ' '.join(str(h) for h in sorted(heroes)),
+        'hero_collisions': len(hero_collisions),
+        'first_hero_collision_time': hero_collisions[0][0] if hero_collisions else ''})
+    hero_speed = [speed[h] for h in heroes if h in speed]
+    if hero_speed:
+        summary['hero_max_speed'] = max(s[0] for s in hero_speed)
+        summary['hero_mean_speed'] = sum(s[1] for s in hero_speed) / sum(s[2] for s in hero_speed)
+        summary['hero_max_acceleration'] = max(acceleration[h] for h in heroes if h in acceleration)
+    hero_controls = [controls[h] for h in heroes if h in controls]
+    if hero_controls:
+        count = sum(c[2] for c in hero_controls)
+        summary['hero_mean_throttle'] = sum(c[0] for c in hero_controls) / count
+        summary['hero_mean_brake'] = sum(c[1] for c in hero_controls) / count
+    return summary
+
+
+def analyze(recording, endpoint, show_all, timeout):
+    """Runs in a worker process: decode one recording and summarise it."""
+    host, port = endpoint
+    local = recording.endswith('.txt')
+    endpoint_name = 'local' if local else '%s:%d' % (host, port)
+    try:
+        if local:
+            lines = iter_file_lines(recording)
+        else:
+            import carla
+            client = carla.Client(host, port)
+            client.set_timeout(timeout)
+            lines = iter_text_lines(client.show_recorder_file_info(recording, show_all))
+        parser = RecorderTextParser()
+        summary = summarize(parser.parse(lines), parser)
+    except Exception as error:
+        summary = dict((field, '') for field in SUMMARY_FIELDS)
+        summary['error'] = str(error) or type(error).__name__
+    summary['endpoint'] = endpoint_name
+    summary['recording'] = recording
+    return summary
+
+
+def merge(summaries):
+    ok = [s for s in summaries if not s['error']]
+    total_duration = sum(s['duration'] for s in ok)
+    total_collisions = sum(s['collisions'] for s in ok)
+    return {
+        'recordings': len(summaries),
+        'failed': len(summaries) - len(ok),
+        'frames': sum(s['frames'] for s in ok),
+        'duration': total_duration,
+        'collisions': total_collisions,
+        'hero_collisions': sum(s['hero_collisions'] for s in ok),
+        'collisions_per_minute': 60.0 * total_collisions / total_duration if total_duration else 0.0,
+    }
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        nargs='+',
+        default=['127.0.0.1'],
+        help='IP of one or more host servers (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        nargs='+',
+        default=[2000],
+        type=int,
+        help='TCP port of each host, or one port for all (default: 2000)')
+    argparser.add_argument(
+        '-r', '--recordings',
+        metavar='GLOB',
+        nargs='+',
+        help='recording names or glob patterns')
+    argparser.add_argument(
+        '-m', '--manifest',
+        metavar='FILE',
+        help='file listing one recording per line')
+    argparser.add_argument(
+        '-a', '--show_all',
+        action='store_true',
+        help='decode all frames so hero speed and controls can be summarised')
+    argparser.add_argument(
+        '-w', '--workers',
+        metavar='N',
+        type=int,
+        default=None,
+        help='worker processes (default: two per endpoint)')
+    argparser.add_argument(
+        '--timeout',
+        metavar='SECONDS',
+        type=float,
+        default=60.0,
+        help='client timeout per recording (default: 60)')
+    argparser.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        help='write the merged report to FILE (.csv or .json), otherwise print it')
+    args = argparser.parse_args()
+
+    recordings = list_recordings(args.recordings, args.manifest)
+    if not recordings:
+        argparser.error('no recordings given, use -r and/or -m')
+    if len(args.port) not in (1, len(args.host)):
+        argparser.error('give one port or one port per host')
+    ports = args.port if len(args.port) == len(args.host) else args.port * len(args.host)
+    endpoints = list(zip(args.host, ports))
+    workers = args.workers or 2 * len(endpoints)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze, recording, endpoints[n % len(endpoints)], args.show_all, args.timeout)
+                   for n, recording in enumerate(recordings)]
+        summaries = []
+        for future in concurrent.futures.as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print('%s: %s' % (summary['recording'], summary['error'] or '%s frames, %s collisions' % (
+                summary['frames'], summary['collisions'])), file=sys.stderr)
+    summaries.sort(key=lambda s: s['recording'])
+    totals = merge(summaries)
+
+    if args.output and args.output.endswith('.csv'):
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summaries)
+    else:
+        report = json.dumps({'totals': totals, 'recordings': summaries}, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(report)
+        else:
+            print(report)
+    print('totals: %s' % json.dumps(totals), file=sys.stderr)
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
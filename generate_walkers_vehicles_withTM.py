@@ -5,8 +5,144 @@ import os
 import queue
 import sys
 
+from world_cache import WorldStateCache
+from world_cache import blueprint_extent
+from world_cache import get_map_cache
+
+SpawnActor = carla.command.SpawnActor
+SetAutopilot = carla.command.SetAutopilot
+FutureActor = carla.command.FutureActor
+DestroyActor = carla.command.DestroyActor
+
+# 每次apply_batch_sync最多携带的命令数，几百个actor只需要几次往返
+BATCH_SIZE = 256
+# 每隔多少个tick检查一次行人是否已到达目标点
+RETARGET_INTERVAL = 20
+# 距目标点小于该距离(米)即视为到达，重新分配目标
+GOAL_REACHED_DISTANCE = 2.0
+
+
+class ActorRegistry(object):
+    """Ids of the actors this script spawned, so cleanup never touches anyone else's."""
+    KINDS = ('controllers', 'sensors', 'walkers', 'vehicles')
+
+    def __init__(self):
+        self.ids = dict((kind, []) for kind in self.KINDS)
+
+    def tracker(self, kind):
+        return self.ids[kind].extend
+
+    def destroy(self, client, world):
+        # 先停止行人控制器，再用一个DestroyActor批命令销毁所有记录过的actor
+        if self.ids['controllers']:
+            for controller in world.get_actors(self.ids['controllers']):
+                controller.stop()
+        batch = [DestroyActor(actor_id) for kind in self.KINDS for actor_id in self.ids[kind]]
+        if batch:
+            apply_batch(client, batch, 'destroy actors')
+        for kind in self.KINDS:
+            del self.ids[kind][:]
+
+
+def apply_batch(client, batch, label, do_tick=False, track=None):
+    """Runs the commands in chunks of BATCH_SIZE, returns the actor id of each (None if it failed).
+
+    track is called with the ids created by every chunk as soon as it returns, so
+    a failure in a later chunk cannot lose the actors spawned by earlier ones.
+    """
+    actor_ids = []
+    failures = 0
+    for start in range(0, len(batch), BATCH_SIZE):
+        chunk_ids = []
+        for response in client.apply_batch_sync(batch[start:start + BATCH_SIZE], do_tick):
+            if response.error:
+                failures += 1
+                if failures <= 5:
+                    print('%s: %s' % (label, response.error))
+                chunk_ids.append(None)
+            else:
+                chunk_ids.append(response.actor_id)
+        if track is not None:
+            track([actor_id for actor_id in chunk_ids if actor_id is not None])
+        actor_ids.extend(chunk_ids)
+    print('%s: %d/%d succeeded in %d batch(es)' % (
+        label, len(batch) - failures, len(batch), (len(batch) + BATCH_SIZE - 1) // BATCH_SIZE))
+    return actor_ids
+
+
+def spawn_vehicles(client, blueprints, planner, count, tm_port, track=None):
+    """Spawns count vehicles on free spawn points taken from planner.
+
+    Spawn points that still fail are replaced by fresh ones in another batch,
+    so fewer than count vehicles only come back when the map runs out of points.
+    """
+    vehicle_ids = []
+    while len(vehicle_ids) < count:
+        # 先选车型，再按该车型的包围盒找空闲的生成点，卡车和公交车不会只按轿车大小检查
+        batch = []
+        for _ in range(count - len(vehicle_ids)):
+            blueprint = random.choice(blueprints)
+            spawn_points = planner.take(1, blueprint_extent(blueprint))
+            if spawn_points:
+                # 生成成功后在同一批命令中直接开启autopilot
+                batch.append(SpawnActor(blueprint, spawn_points[0]).then(SetAutopilot(FutureActor, True, tm_port)))
+        if not batch:
+            print('spawn vehicles: only %d free spawn points for %d vehicles' % (len(vehicle_ids), count))
+            break
+        actor_ids = apply_batch(client, batch, 'spawn vehicles', track=track)
+        vehicle_ids.extend(actor_id for actor_id in actor_ids if actor_id is not None)
+    return vehicle_ids
+
+
+def spawn_walkers(client, blueprints, spawn_points, percentage_running, track=None):
+    """Returns (walker_id, max_speed) for every walker that spawned."""
+    batch = []
+    speeds = []
+    for spawn_point in spawn_points:
+        walker_bp = random.choice(blueprints)
+        # 取消行人无敌状态
+        if walker_bp.has_attribute('is_invincible'):
+            walker_bp.set_attribute('is_invincible', 'false')
+        # 设置行人的移动速度：走路或跑步
+        if walker_bp.has_attribute('speed'):
+            speed_values = walker_bp.get_attribute('speed').recommended_values
+            speeds.append(float(speed_values[2] if random.random() < percentage_running else speed_values[1]))
+        else:
+            speeds.append(0.0)
+        batch.append(SpawnActor(walker_bp, spawn_point))
+    actor_ids = apply_batch(client, batch, 'spawn walkers', track=track)
+    return [(actor_id, speed) for actor_id, speed in zip(actor_ids, speeds) if actor_id is not None]
+
+
+def spawn_walker_controllers(client, controller_bp, walker_ids, track=None):
+    """Returns (controller_id, walker_id) for every controller that spawned."""
+    batch = [SpawnActor(controller_bp, carla.Transform(), walker_id) for walker_id in walker_ids]
+    actor_ids = apply_batch(client, batch, 'spawn walker controllers', track=track)
+    return [(actor_id, walker_id) for actor_id, walker_id in zip(actor_ids, walker_ids) if actor_id is not None]
+
+
+def retarget_walkers(state, pool, goals):
+    """Sends every walker that reached its goal to a new point from pool.
+
+    goals maps walker_id -> [controller, goal]; positions come from the tick
+    snapshot, so only walkers that get a new goal cost an RPC.
+    """
+    for walker_id, entry in goals.items():
+        transform = state.transform(walker_id)
+        if transform is None:
+            continue
+        location = transform.location
+        controller, goal = entry
+        if math.hypot(location.x - goal[0], location.y - goal[1]) < GOAL_REACHED_DISTANCE:
+            entry[1] = pool.destination(away_from=goal)
+            controller.go_to_location(carla.Location(*entry[1]))
+
 
 def main():
+    client = None
+    world = None
+    traffic_manager = None
+    registry = ActorRegistry()
     try:
 
         # setup client并且加载我们所需要的地图
@@ -39,76 +175,53 @@ def main():
         # # 将观察者设置到新方位上
         # spectator.set_transform(new_transform)
 
-        # 获得整个的blueprint库并从中筛选出车辆
-        vehicle_blueprints = world.get_blueprint_library().filter('*vehicle*')
-
-        # 获得整个的blueprint库并从中筛选出行人
-        ped_blueprints = world.get_blueprint_library().filter('*pedestrian*')
-
-        # 通过world获得map并获得所有可以生成车辆的地点
-        vehicle_spawn_points = world.get_map().get_spawn_points()
-
-        # 通过world获得所有可以生成行人的地点并存储
-        ped_spawn_points = []
-        for i in range(num_walkers):
-            spawn_point = carla.Transform()
-            loc = world.get_random_location_from_navigation()
-            if loc is not None:
-                spawn_point.location = loc
-                ped_spawn_points.append(spawn_point)
-
-        # 在地图上随机生成num_vehicle辆车，每辆车为车辆蓝图库中的随机车辆
-        for i in range(0, num_vehicle):
-            world.try_spawn_actor(random.choice(vehicle_blueprints),
-                                  random.choice(vehicle_spawn_points))
-
-        # 创建用来存储行人，行人速度设置和行人控制器的list
-        walker_batch = []
-        walker_speed = []
-        walker_ai_batch = []
-
-        # 在地图上随机生成num_walkers个行人，每个行人为行人蓝图库中的随机行人，并设定行人的移动速度
-        for j in range(num_walkers):
-            walker_bp = random.choice(ped_blueprints)
-
-            # 取消行人无敌状态
-            if walker_bp.has_attribute('is_invincible'):
-                walker_bp.set_attribute('is_invincible', 'false')
-
-            # 设置行人的移动速度
-            if walker_bp.has_attribute('speed'):
-                if random.random() > percentage_pedestrians_running:
-                    # 将对应行人速度设置为走路速度
-                    walker_speed.append(walker_bp.get_attribute('speed').recommended_values[1])
-                else:
-                    # 将对应行人速度设置为跑步速度
-                    walker_speed.append(walker_bp.get_attribute('speed').recommended_values[2])
-            # 从可生成行人的生成点中随机选择并生成随机行人，之后将生成的行人添加到同一批中
-            walker_batch.append(world.try_spawn_actor(walker_bp, random.choice(ped_spawn_points)))
-
-        # 从蓝图库中寻找控制行人行动逻辑的控制器
-        walker_ai_blueprint = world.get_blueprint_library().find('controller.ai.walker')
-
-        # 为整批行人各自生成对应的控制器，并把控制器添加到代表批量控制器的列表中
-        for walker in world.get_actors().filter('*pedestrian*'):
-            walker_ai_batch.append(world.spawn_actor(walker_ai_blueprint, carla.Transform(), walker))
-
-        # 批量启动行人控制器，并设置控制器参数
-        for i in range(len(walker_ai_batch)):
+        # 获得整个的blueprint库并从中筛选出车辆和行人
+        map_cache = get_map_cache(world)
+        blueprint_library = map_cache.blueprint_library
+        vehicle_blueprints = blueprint_library.filter('*vehicle*')
+        ped_blueprints = blueprint_library.filter('*pedestrian*')
+
+        # 生成点不放回地抽取，并避开已有车辆和行人（如hero车）的包围盒
+        actors = world.get_actors()
+        vehicle_planner = map_cache.spawn_planner(
+            list(actors.filter('vehicle.*')) + list(actors.filter('walker.pedestrian.*')))
+
+        # 行人的生成点和目标点都取自同一个导航点池，池按地图缓存在磁盘上，
+        # 生成点不放回地抽取且彼此间隔不小于2米，避免行人叠在一起
+        navigation = map_cache.navigation_pool(size=num_walkers)
+        ped_spawn_points = [carla.Transform(carla.Location(*location)) for location in navigation.take(num_walkers)]
+
+        # 批量生成num_vehicle辆车并开启autopilot，每辆车为车辆蓝图库中的随机车辆
+        vehicle_ids = spawn_vehicles(client, vehicle_blueprints, vehicle_planner, num_vehicle,
+                                     traffic_manager.get_port(), track=registry.tracker('vehicles'))
+
+        # 批量生成行人，并记录每个行人的移动速度
+        walkers = spawn_walkers(client, ped_blueprints, ped_spawn_points, percentage_pedestrians_running,
+                                track=registry.tracker('walkers'))
+
+        # 为整批行人各自生成对应的控制器
+        walker_ai_blueprint = blueprint_library.find('controller.ai.walker')
+        controllers = spawn_walker_controllers(client, walker_ai_blueprint, [w[0] for w in walkers],
+                                               track=registry.tracker('controllers'))
+        walker_speed = dict(walkers)
+
+        # start/go_to_location/set_max_speed没有对应的批量命令，但控制器对象一次取回
+        controller_actors = world.get_actors([c[0] for c in controllers])
+        walker_goals = {}
+        for controller_id, walker_id in controllers:
+            walker_ai = controller_actors.find(controller_id)
             # 启动控制器
-            walker_ai_batch[i].start()
+            walker_ai.start()
             # 通过控制器设置行人的目标点
-            walker_ai_batch[i].go_to_location(world.get_random_location_from_navigation())
+            goal = navigation.destination()
+            walker_ai.go_to_location(carla.Location(*goal))
+            walker_goals[walker_id] = [walker_ai, goal]
             # 通过控制器设置行人的行走速度
-            walker_ai_batch[i].set_max_speed(float(walker_speed[i]))
+            walker_ai.set_max_speed(walker_speed[walker_id])
 
         # 设置行人横穿马路的参数
         world.set_pedestrians_cross_factor(percentage_pedestrians_crossing)
 
-        # 从world中获取车辆，并将每辆车的autopilot模式设置为打开
-        for vehicle in world.get_actors().filter('*vehicle*'):
-            vehicle.set_autopilot()
-
 
         for actor in world.get_actors():
             if actor.attributes.get('role_name') == 'hero':
@@ -125,6 +238,7 @@ def main():
         # 生成rgb相机并用SpringArmGhost的方式绑定到主车上
         camera = world.spawn_actor(camera_bp, camera_transform, attach_to=player,
                                    attachment_type=carla.libcarla.AttachmentType.SpringArmGhost)
+        registry.tracker('sensors')([camera.id])
 
         setting = world.get_settings()
         setting.synchronous_mode = True
@@ -138,34 +252,45 @@ def main():
         for vehicle in world.get_actors().filter('*vehicle*'):
             traffic_manager.update_vehicle_lights(vehicle, True)
 
+        # 观察者只取一次，相机方位每个tick从快照中读取，不再逐帧发RPC
+        spectator = world.get_spectator()
+        state = WorldStateCache()
+        state.refresh(world)
+        ticks = 0
         while True:
-            # 从world中获取观察者视角，并将观察者视角的方位信息设置为相机的对应方位信息
-            world.get_spectator().set_transform(camera.get_transform())
+            # 将观察者视角的方位信息设置为相机的对应方位信息
+            camera_transform = state.transform(camera.id)
+            if camera_transform is not None:
+                spectator.set_transform(camera_transform)
 
             # 如果为同步模式设定
             if traffic_manager.synchronous_mode:
                 world.tick()
+                state.refresh(world)
             # 如果为异步模式设定
             else:
-                world.wait_for_tick()
+                state.wait(world)
+
+            # 到达目标的行人重新分配目标点，保持人群持续移动
+            ticks += 1
+            if ticks % RETARGET_INTERVAL == 0:
+                retarget_walkers(state, navigation, walker_goals)
             # 等待server更新world状态
             # world.wait_for_tick()
 
     finally:
-        # 停止并销毁所有controller
-        for controller in world.get_actors().filter('*controller*'):
-            controller.stop()
-        # 销毁所有车辆
-        for vehicle in world.get_actors().filter('*vehicle*'):
-            vehicle.destroy()
-        # 销毁所有行人
-        for walker in world.get_actors().filter('*walker*'):
-            walker.destroy()
-
-        settings = world.get_settings()
-        settings.synchronous_mode = False
-        settings.fixed_delta_seconds = None
-        world.apply_settings(settings)
+        if world is not None:
+            try:
+                # 无论生成是否成功，都先恢复异步模式，避免server停在等待tick的状态
+                settings = world.get_settings()
+                settings.synchronous_mode = False
+                settings.fixed_delta_seconds = None
+                world.apply_settings(settings)
+                if traffic_manager is not None:
+                    traffic_manager.set_synchronous_mode(False)
+            finally:
+                # 只销毁本脚本生成的actor，hero等其他actor保持不变
+                registry.destroy(client, world)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Indexes a CARLA recording once and answers per-actor / frame-range queries
+from the sidecar index, without asking the server to decode the .log again.
+
+  # decode est1.log on the server once and write est1.idx/
+  python query_recorder_index.py -f est1.log --build
+  # hero telemetry between frames 5000 and 6000
+  python query_recorder_index.py -f est1.log -i 123 --frames 5000 6000
+  # all collisions involving vehicle 87
+  python query_recorder_index.py -f est1.log -q collisions -i 87
+"""
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import argparse
+import csv
+
+import numpy as np
+
+from recorder_parser import ColumnarWriter
+from recorder_parser import RecorderTextParser
+from recorder_parser import SCHEMAS
+from recorder_parser import build_index
+from recorder_parser import iter_file_lines
+from recorder_parser import iter_text_lines
+from recorder_parser import load_index
+from recorder_parser import query
+
+TELEMETRY_TABLES = ('transforms', 'controls', 'kinematics')
+
+
+def default_index_dir(recorder_filename):
+    return os.path.splitext(os.path.basename(recorder_filename))[0] + '.idx'
+
+
+def build(args, index_dir):
+    if args.input_text:
+        lines = iter_file_lines(args.input_text)
+    else:
+        # carla is only needed to build the index, queries run without it
+        import carla
+        client = carla.Client(args.host, args.port)
+        client.set_timeout(60.0)
+        lines = iter_text_lines(client.show_recorder_file_info(args.recorder_filename, True))
+    parser = RecorderTextParser()
+    writer = ColumnarWriter(index_dir, args.chunk_frames)
+    writer.write_all(parser.parse(lines))
+    info = dict(parser.info, recorder_filename=args.recorder_filename)
+    writer.close(info)
+    index = build_index(index_dir)
+    print('indexed %s into %s: %d chunk(s), %d actor(s)' % (
+        args.recorder_filename, index_dir, len(index['chunks']), len(index['actors'])))
+
+
+def telemetry(index_dir, actor_id, first_frame, last_frame):
+    """One row per frame joining transform, control and kinematics of actor_id."""
+    index = load_index(index_dir)
+    tables = [(table, query(index_dir, table, actor_id, first_frame, last_frame, index))
+              for table in TELEMETRY_TABLES]
+    frames = np.unique(np.concatenate([array['frame'] for _, array in tables]))
+    times = query(index_dir, 'frames', None, first_frame, last_frame, index)
+    header = ['frame', 'time']
+    columns = [frames, _lookup(times, 'time', frames)]
+    for table, array in tables:
+        for name in array.dtype.names:
+            if name not in ('frame', 'id'):
+                header.append(name)
+                columns.append(_lookup(array, name, frames))
+    return header, zip(*columns)
+
+
+def _lookup(array, name, frames):
+    # value of column name at each frame, '' where the table has no row for it
+    array = np.sort(array, order='frame')
+    positions = np.searchsorted(array['frame'], frames)
+    values = []
+    for frame, position in zip(frames, positions):
+        if position < len(array) and array['frame'][position] == frame:
+            values.append(array[name][position].item())
+        else:
+            values.append('')
+    return values
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        default=2000,
+        type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '-f', '--recorder_filename',
+        metavar='F',
+        default="est1.log",
+        help='recorder filename (est1.log)')
+    argparser.add_argument(
+        '-d', '--index_dir',
+        metavar='DIR',
+        help='index directory (default: <recording name>.idx)')
+    argparser.add_argument(
+        '--build',
+        action='store_true',
+        help='decode the recording once and (re)build the index')
+    argparser.add_argument(
+        '--input_text',
+        metavar='FILE',
+        help='build the index from a saved show_all info text file instead of the server')
+    argparser.add_argument(
+        '--chunk_frames',
+        metavar='N',
+        default=1000,
+        type=int,
+        help='frames per index chunk (default: 1000)')
+    argparser.add_argument(
+        '-q', '--query',
+        default='telemetry',
+        choices=['telemetry'] + sorted(t for t in SCHEMAS),
+        help='what to look up (default: telemetry)')
+    argparser.add_argument(
+        '-i', '--actor_id',
+        type=int,
+        default=None,
+        help='only rows involving this actor id')
+    argparser.add_argument(
+        '--frames',
+        metavar=('FIRST', 'LAST'),
+        nargs=2,
+        type=int,
+        default=(None, None),
+        help='only rows between these frames (inclusive)')
+    argparser.add_argument(
+        '-s', '--save_to_file',
+        metavar='S',
+        help='save result to a CSV file instead of printing it')
+    args = argparser.parse_args()
+
+    index_dir = args.index_dir or default_index_dir(args.recorder_filename)
+    if args.build:
+        build(args, index_dir)
+        return
+    if not os.path.exists(os.path.join(index_dir, 'index.json')):
+        argparser.error('no index in %s, run with --build first' % index_dir)
+
+    first_frame, last_frame = args.frames
+    if args.query == 'telemetry':
+        if args.actor_id is None:
+            argparser.error('telemetry needs an actor id (-i)')
+        header, rows = telemetry(index_dir, args.actor_id, first_frame, last_frame)
+    else:
+        array = query(index_dir, args.query, args.actor_id, first_frame, last_frame)
+        header, rows = list(array.dtype.names), array.tolist()
+
+    if args.save_to_file:
+        with open(args.save_to_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Streaming parser for the text returned by client.show_recorder_file_info().
+
+The text is read line by line and turned into typed records, one table per
+kind of data, which ColumnarWriter stores as NPZ chunks of whole frames.
+Only numpy is needed, so recordings can be analysed without a CARLA server.
+"""
+
+import glob
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+
+# ==============================================================================
+# -- schemas -------------------------------------------------------------------
+# ==============================================================================
+
+
+SCHEMAS = {
+    'frames': [('frame', np.int64), ('time', np.float64)],
+    'events': [('frame', np.int64), ('kind', 'U8'), ('id', np.int64), ('other', np.int64), ('description', 'U64')],
+    'transforms': [('frame', np.int64), ('id', np.int64),
+                   ('x', np.float32), ('y', np.float32), ('z', np.float32),
+                   ('roll', np.float32), ('pitch', np.float32), ('yaw', np.float32)],
+    'controls': [('frame', np.int64), ('id', np.int64), ('steer', np.float32), ('throttle', np.float32),
+                 ('brake', np.float32), ('handbrake', np.bool_), ('gear', np.int32)],
+    'lights': [('frame', np.int64), ('id', np.int64), ('lights', 'U128')],
+    'kinematics': [('frame', np.int64), ('id', np.int64),
+                   ('vx', np.float32), ('vy', np.float32), ('vz', np.float32),
+                   ('wx', np.float32), ('wy', np.float32), ('wz', np.float32),
+                   ('ax', np.float32), ('ay', np.float32), ('az', np.float32)],
+    'walkers': [('frame', np.int64), ('id', np.int64), ('speed', np.float32)],
+    'traffic_lights': [('frame', np.int64), ('id', np.int64), ('state', np.int8), ('frozen', np.bool_),
+                       ('elapsed', np.float32)],
+    'collisions': [('frame', np.int64), ('collision_id', np.int64), ('actor1', np.int64), ('actor2', np.int64),
+                   ('hero1', np.bool_), ('hero2', np.bool_)],
+}
+
+# tables whose records carry a single actor id in the 'id' column
+ACTOR_TABLES = ('transforms', 'controls', 'lights', 'kinematics', 'walkers', 'traffic_lights')
+
+
+# ==============================================================================
+# -- RecorderTextParser --------------------------------------------------------
+# ==============================================================================
+
+
+_FRAME = re.compile(r'^Frame (\d+) at ([-+\d.eE]+) seconds')
+_HEADER = re.compile(r'^(Version|Map|Date|Frames|Duration): (.*?)\s*$')
+_CREATE = re.compile(r'^ Create (\d+): (\S+) \((\d+)\)')
+_DESTROY = re.compile(r'^ Destroy (\d+)')
+_PARENT = re.compile(r'^ Parenting (\d+) with (\d+)')
+_COLLISION = re.compile(r'^ Collision id (\d+) between (\d+)( \(hero\))?.*? with (\d+)( \(hero\))?')
+_SECTION = re.compile(r'^ ([A-Za-z][A-Za-z ]*?): \d+\s*$')
+_ITEM = re.compile(r'^  Id: (\d+)\s*(.*?)\s*$')
+_ATTRIBUTE = re.compile(r'^  (\S+) = (.*?)\s*$')
+_TRANSFORM = re.compile(r'Location: \(([^)]*)\) Rotation: \(([^)]*)\)')
+_CONTROL = re.compile(r'Steering: (\S+) Throttle: (\S+) Brake:? (\S+) Handbrake: (\S+) Gear: (\S+)')
+_KINEMATICS = re.compile(r'linear_velocity: \(([^)]*)\) angular_velocity: \(([^)]*)\) acceleration: \(([^)]*)\)')
+_WALKER = re.compile(r'speed: (\S+)')
+_TRAFFIC_LIGHT = re.compile(r'state: (\d+) frozen: (\d+) elapsedTime: (\S+)')
+
+
+def _floats(text):
+    return [float(v) for v in text.split(',')]
+
+
+class RecorderTextParser(object):
+    """Turns recorder info lines into (table, record) pairs, frame by frame.
+
+    actor_ids restricts per-actor tables to those ids; collisions and events
+    are kept when any of their actors matches. Frames are always kept.
+    """
+
+    def __init__(self, actor_ids=None):
+        self.actor_ids = set(actor_ids) if actor_ids is not None else None
+        self.info = {}
+        self.hero_ids = set()
+        self.unparsed = 0
+        self.frame = None
+        self.time = None
+        self._section = None
+        self._created = None
+
+    def _wanted(self, *ids):
+        return self.actor_ids is None or any(i in self.actor_ids for i in ids)
+
+    def parse(self, lines):
+        for line in lines:
+            record = self.parse_line(line.rstrip('\r\n'))
+            if record is not None:
+                yield record
+
+    def parse_line(self, line):
+        if not line.strip():
+            return None
+        match = _FRAME.match(line)
+        if match:
+            self.frame = int(match.group(1))
+            self.time = float(match.group(2))
+            self._section = None
+            return 'frames', (self.frame, self.time)
+        if line.startswith('  '):
+            return self._parse_item(line)
+        if line.startswith(' '):
+            return self._parse_event(line)
+        match = _HEADER.match(line)
+        if match:
+            self.info[match.group(1).lower()] = match.group(2)
+            return None
+        self.unparsed += 1
+        return None
+
+    def _parse_event(self, line):
+        match = _SECTION.match(line)
+        if match:
+            self._section = match.group(1).lower()
+            return None
+        self._section = None
+        self._created = None
+        match = _COLLISION.match(line)
+        if match:
+            actor1, actor2 = int(match.group(2)), int(match.group(4))
+            if not self._wanted(actor1, actor2):
+                return None
+            return 'collisions', (self.frame, int(match.group(1)), actor1, actor2,
+                                  match.group(3) is not None, match.group(5) is not None)
+        match = _CREATE.match(line)
+        if match:
+            actor_id = int(match.group(1))
+            self._created = actor_id
+            if not self._wanted(actor_id):
+                return None
+            return 'events', (self.frame, 'create', actor_id, -1, match.group(2))
+        match = _DESTROY.match(line)
+        if match:
+            actor_id = int(match.group(1))
+            if not self._wanted(actor_id):
+                return None
+            return 'events', (self.frame, 'destroy', actor_id, -1, '')
+        match = _PARENT.match(line)
+        if match:
+            actor_id, parent_id = int(match.group(1)), int(match.group(2))
+            if not self._wanted(actor_id, parent_id):
+                return None
+            return 'events', (self.frame, 'parent', actor_id, parent_id, '')
+        self.unparsed += 1
+        return None
+
+    def _parse_item(self, line):
+        match = _ITEM.match(line)
+        if match is None:
+            # Actor attributes listed under a Create line, only the hero role is kept.
+            match = _ATTRIBUTE.match(line)
+            if match and self._created is not None and match.groups() == ('role_name', 'hero'):
+                self.hero_ids.add(self._created)
+            return None
+        actor_id = int(match.group(1))
+        if not self._wanted(actor_id):
+            return None
+        rest = match.group(2)
+        section = self._section
+        try:
+            if section == 'positions':
+                m = _TRANSFORM.search(rest)
+                if m:
+                    return 'transforms', tuple([self.frame, actor_id] + _floats(m.group(1)) + _floats(m.group(2)))
+            elif section == 'vehicle animations':
+                m = _CONTROL.search(rest)
+                if m:
+                    return 'controls', (self.frame, actor_id, float(m.group(1)), float(m.group(2)),
+                                        float(m.group(3)), float(m.group(4)) != 0.0, int(float(m.group(5))))
+            elif section == 'vehicle light animations':
+                return 'lights', (self.frame, actor_id, rest)
+            elif section == 'dynamic actors':
+                m = _KINEMATICS.search(rest)
+                if m:
+                    return 'kinematics', tuple([self.frame, actor_id] + _floats(m.group(1)) +
+                                               _floats(m.group(2)) + _floats(m.group(3)))
+            elif section == 'walker animations':
+                m = _WALKER.search(rest)
+                if m:
+                    return 'walkers', (self.frame, actor_id, float(m.group(1)))
+            elif section == 'state traffic lights':
+                m = _TRAFFIC_LIGHT.search(rest)
+                if m:
+                    return 'traffic_lights', (self.frame, actor_id, int(m.group(1)), m.group(2) != '0',
+                                              float(m.group(3)))
+            else:
+                return None
+        except ValueError:
+            pass
+        self.unparsed += 1
+        return None
+
+
+def iter_text_lines(text):
+    """Lines of a server reply, without building a list of them."""
+    return iter(io.StringIO(text))
+
+
+def iter_file_lines(path):
+    """Lines of a saved recorder info text file, read lazily from disk."""
+    with io.open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            yield line
+
+
+def filter_text_lines(lines, actor_id):
+    """Header and frame lines plus the lines that mention exactly actor_id (123 never matches 1234)."""
+    exact = re.compile(r'(?:Id: |between |with |Create |Destroy |Parenting )%d(?!\d)' % actor_id)
+    for line in lines:
+        if _HEADER.match(line) or _FRAME.match(line) or exact.search(line):
+            yield line
+
+
+# ==============================================================================
+# -- collision report ----------------------------------------------------------
+# ==============================================================================
+
+
+# "      16   v v     122 vehicle.yamaha.yzf     118 vehicle.dodge_charger.police"
+_COLLISION_ROW = re.compile(r'^\s*([-+\d.eE]+)\s+(\w)\s+(\w)\s+(\d+)\s+(\S+)\s+(\d+)(?:\s+(\S+))?\s*$')
+
+
+def parse_collision_report(lines):
+    """Header info and one dict per row of client.show_recorder_collisions() output."""
+    info = {}
+    collisions = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = _HEADER.match(line)
+        if match:
+            info[match.group(1).lower()] = match.group(2)
+            continue
+        match = _COLLISION_ROW.match(line)
+        if match:
+            collisions.append({
+                'time': float(match.group(1)),
+                'type1': match.group(2), 'type2': match.group(3),
+                'id1': int(match.group(4)), 'name1': match.group(5),
+                'id2': int(match.group(6)), 'name2': match.group(7) or ''})
+    return info, collisions
+
+
+def _seconds(text):
+    try:
+        return float(text.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def collision_aggregates(info, collisions):
+    """Counts per actor pair and per type pair, collisions per minute and first collision time."""
+    pairs = {}
+    types = {}
+    for c in collisions:
+        key = tuple(sorted([(c['id1'], c['name1']), (c['id2'], c['name2'])]))
+        pairs[key] = pairs.get(key, 0) + 1
+        type_key = ''.join(sorted(c['type1'] + c['type2']))
+        types[type_key] = types.get(type_key, 0) + 1
+    duration = _seconds(info.get('duration'))
+    return {
+        'collisions': len(collisions),
+        'duration': duration,
+        'collisions_per_minute': 60.0 * len(collisions) / duration if duration else None,
+        'first_collision_time': min(c['time'] for c in collisions) if collisions else None,
+        'per_type_pair': types,
+        'per_actor_pair': [
+            {'id1': a[0], 'name1': a[1], 'id2': b[0], 'name2': b[1], 'count': count}
+            for (a, b), count in sorted(pairs.items(), key=lambda item: -item[1])],
+    }
+
+
+# ==============================================================================
+# -- ColumnarWriter ------------------------------------------------------------
+# ==============================================================================
+
+
+class ColumnarWriter(object):
+    """Buffers parsed records and writes them as NPZ chunks of chunk_frames frames.
+
+    Each chunk is one <table>-<chunk>.npz file holding one array per column;
+    meta.json describes the recording, the tables and how many chunks exist.
+    Chunks, meta.json and index.json left in directory by an earlier run are
+    removed first, because tables without rows write no chunk to replace them.
+    """
+
+    def __init__(self, directory, chunk_frames=1000):
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self.chunks = 0
+        self.rows = dict((table, 0) for table in SCHEMAS)
+        self._buffers = dict((table, []) for table in SCHEMAS)
+        self._frames_in_chunk = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        stale = [os.path.join(directory, name) for name in ('meta.json', INDEX_FILE)]
+        for table in SCHEMAS:
+            stale.extend(glob.glob(os.path.join(directory, '%s-[0-9][0-9][0-9][0-9][0-9].npz' % table)))
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, table, record):
+        if table == 'frames':
+            # Flush on a frame boundary so no frame is split across chunks.
+            if self._frames_in_chunk >= self.chunk_frames:
+                self.flush()
+            self._frames_in_chunk += 1
+        self._buffers[table].append(record)
+
+    def write_all(self, records):
+        for table, record in records:
+            self.write(table, record)
+
+    def flush(self):
+        if not any(self._buffers.values()):
+            return
+        for table, rows in self._buffers.items():
+            if not rows:
+                continue
+            array = np.array(rows, dtype=SCHEMAS[table])
+            path = os.path.join(self.directory, '%s-%05d.npz' % (table, self.chunks))
+            np.savez(path, **dict((name, array[name]) for name in array.dtype.names))
+            self.rows[table] += len(rows)
+            del rows[:]
+        self.chunks += 1
+        self._frames_in_chunk = 0
+
+    def close(self, info=None):
+        self.flush()
+        meta = {
+            'info': info or {},
+            'chunks': self.chunks,
+            'chunk_frames': self.chunk_frames,
+            'rows': self.rows,
+            'schemas': dict((table, [(name, np.dtype(t).str) for name, t in schema])
+                            for table, schema in SCHEMAS.items()),
+        }
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+def load_meta(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        return json.load(f)
+
+
+def load_chunk(directory, table, chunk):
+    """One chunk of a table as a structured array, or None if it has no rows."""
+    path = os.path.join(directory, '%s-%05d.npz' % (table, chunk))
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as columns:
+        array = np.empty(len(columns['frame']), dtype=SCHEMAS[table])
+        for name in array.dtype.names:
+            array[name] = columns[name]
+    return array
+
+
+def load_table(directory, table):
+    """Every chunk of a table concatenated into one structured array."""
+    chunks = [load_chunk(directory, table, n) for n in range(load_meta(directory)['chunks'])]
+    chunks = [c for c in chunks if c is not None]
+    if not chunks:
+        return np.empty(0, dtype=SCHEMAS[table])
+    return np.concatenate(chunks)
+
+
+# ==============================================================================
+# -- index ---------------------------------------------------------------------
+# ==============================================================================
+
+
+INDEX_FILE = 'index.json'
+
+
+def build_index(directory):
+    """Writes index.json: frame range per chunk and, per actor and table, the chunks holding it."""
+    meta = load_meta(directory)
+    chunks = []
+    actors = {}
+    tables = dict((table, []) for table in SCHEMAS)
+    for n in range(meta['chunks']):
+        frames = load_chunk(directory, 'frames', n)
+        if frames is not None and len(frames):
+            chunks.append({'chunk': n, 'first_frame': int(frames['frame'].min()),
+                           'last_frame': int(frames['frame'].max())})
+        else:
+            chunks.append({'chunk': n, 'first_frame': None, 'last_frame': None})
+        for table in SCHEMAS:
+            if table == 'frames':
+                continue
+            array = load_chunk(directory, table, n)
+            if array is None or not len(array):
+                continue
+            tables[table].append(n)
+            if table == 'collisions':
+                ids = np.union1d(array['actor1'], array['actor2'])
+            elif table == 'events':
+                ids = np.union1d(array['id'], array['other'][array['other'] >= 0])
+            else:
+                ids = np.unique(array['id'])
+            for actor_id in ids.tolist():
+                actors.setdefault(str(actor_id), {}).setdefault(table, []).append(n)
+    index = {'info': meta['info'], 'chunks': chunks, 'tables': tables, 'actors': actors}
+    with open(os.path.join(directory, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def load_index(directory):
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def query(directory, table, actor_id=None, first_frame=None, last_frame=None, index=None):
+    """Rows of table for actor_id within [first_frame, last_frame], reading only the chunks that can hold them."""
+    index = index or load_index(directory)
+    if actor_id is None:
+        candidates = index['tables'][table] if table != 'frames' else [c['chunk'] for c in index['chunks']]
+    else:
+        candidates = index['actors'].get(str(actor_id), {}).get(table, [])
+    ranges = dict((c['chunk'], c) for c in index['chunks'])
+    parts = []
+    for n in candidates:
+        chunk = ranges[n]
+        if chunk['first_frame'] is not None:
+            if first_frame is not None and chunk['last_frame'] < first_frame:
+                continue
+            if last_frame is not None and chunk['first_frame'] > last_frame:
+                continue
+        array = load_chunk(directory, table, n)
+        if array is None:
+            continue
+        mask = np.ones(len(array), dtype=bool)
+        if actor_id is not None:
+            if table == 'collisions':
+                mask &= (array['actor1'] == actor_id) | (array['actor2'] == actor_id)
+            elif table == 'events':
+                mask &= (array['id'] == actor_id) | (array['other'] == actor_id)
+            elif table != 'frames':
+                mask &= array['id'] == actor_id
+        if first_frame is not None:
+            mask &= array['frame'] >= first_frame
+        if last_frame is not None:
+            mask &= array['frame'] <= last_frame
+        parts.append(array[mask])
+    if not parts:
+        return np.empty(0, dtype=SCHEMAS[table])
+    return np.concatenate(parts)
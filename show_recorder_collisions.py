@@ -21,6 +21,45 @@ except IndexError:
 import carla
 
 import argparse
+import csv
+import hashlib
+import json
+
+from recorder_parser import collision_aggregates
+from recorder_parser import iter_text_lines
+from recorder_parser import parse_collision_report
+
+CSV_FIELDS = ['time', 'type1', 'type2', 'id1', 'name1', 'id2', 'name2']
+
+
+def cache_path(cache_dir, recording_path, types):
+    """Cache file for this recording version and type filter, None if the .log is not local."""
+    if not cache_dir or not recording_path or not os.path.isfile(recording_path):
+        return None
+    key = '%s|%r|%s' % (os.path.abspath(recording_path), os.path.getmtime(recording_path), types)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def collision_report(client, args):
+    path = cache_path(args.cache_dir, args.recording_path or args.recorder_filename, args.types)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    # types pattern samples:
+    # -t aa == any to any == show every collision (the default)
+    # -t vv == vehicle to vehicle == show every collision between vehicles only
+    # -t vt == vehicle to traffic light == show every collision between a vehicle and a traffic light
+    # -t hh == hero to hero == show collision between a hero and another hero
+    text = client().show_recorder_collisions(args.recorder_filename, args.types[0], args.types[1])
+    info, collisions = parse_collision_report(iter_text_lines(text))
+    report = {'recorder_filename': args.recorder_filename, 'types': args.types, 'info': info,
+              'aggregates': collision_aggregates(info, collisions), 'collisions': collisions, 'text': text}
+    if path:
+        if not os.path.isdir(args.cache_dir):
+            os.makedirs(args.cache_dir)
+        with open(path, 'w') as f:
+            json.dump(report, f)
+    return report
 
 
 def main():
@@ -49,19 +88,53 @@ def main():
         metavar='T',
         default="aa",
         help='pair of types (a=any, h=hero, v=vehicle, w=walkers, t=trafficLight, o=others')
+    argparser.add_argument(
+        '--format',
+        choices=['text', 'json', 'csv'],
+        default='text',
+        help='text prints the server output as is, json/csv the parsed collisions (default: text)')
+    argparser.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        help='write the result to FILE instead of printing it')
+    argparser.add_argument(
+        '--recording_path',
+        metavar='PATH',
+        help='local path of the .log, used to key the cache on its mtime (default: the -f value)')
+    argparser.add_argument(
+        '--cache_dir',
+        metavar='DIR',
+        default='.collision_cache',
+        help='where parsed reports are cached, empty to disable (default: .collision_cache)')
     args = argparser.parse_args()
 
     try:
 
-        client = carla.Client(args.host, args.port)
-        client.set_timeout(60.0)
+        def client():
+            # Only connect when the report is not cached.
+            client = carla.Client(args.host, args.port)
+            client.set_timeout(60.0)
+            return client
+
+        report = collision_report(client, args)
 
-        # types pattern samples:
-        # -t aa == any to any == show every collision (the default)
-        # -t vv == vehicle to vehicle == show every collision between vehicles only
-        # -t vt == vehicle to traffic light == show every collision between a vehicle and a traffic light
-        # -t hh == hero to hero == show collision between a hero and another hero
-        print(client.show_recorder_collisions(args.recorder_filename, args.types[0], args.types[1]))
+        if args.format == 'csv':
+            f = open(args.output, 'w', newline='') if args.output else sys.stdout
+            writer = csv.DictWriter(f, CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(report['collisions'])
+            if args.output:
+                f.close()
+        else:
+            if args.format == 'json':
+                result = json.dumps(dict((k, v) for k, v in report.items() if k != 'text'), indent=2)
+            else:
+                result = report['text']
+            if args.output:
+                with open(args.output, 'w') as f:
+                    f.write(result)
+            else:
+                print(result)
 
     finally:
         pass
@@ -22,6 +22,12 @@ import carla
 
 import argparse
 
+from recorder_parser import ColumnarWriter
+from recorder_parser import RecorderTextParser
+from recorder_parser import filter_text_lines
+from recorder_parser import iter_file_lines
+from recorder_parser import iter_text_lines
+
 
 def main():
 
@@ -59,32 +65,59 @@ def main():
         default=None,
         help='ID of the hero vehicle to filter logs for'
     )
+    argparser.add_argument(
+        '-c', '--columnar',
+        metavar='DIR',
+        help='parse the info into typed tables and store them as NPZ chunks in DIR')
+    argparser.add_argument(
+        '--chunk_frames',
+        metavar='N',
+        default=1000,
+        type=int,
+        help='frames per NPZ chunk (default: 1000)')
+    argparser.add_argument(
+        '--input_text',
+        metavar='FILE',
+        help='read a previously saved info text file instead of asking the server')
 
     args = argparser.parse_args()
 
     try:
 
-        client = carla.Client(args.host, args.port)
-        client.set_timeout(60.0)
+        if args.input_text:
+            # 从磁盘逐行读取，不需要把整个文本读进内存
+            lines = iter_file_lines(args.input_text)
+        else:
+            client = carla.Client(args.host, args.port)
+            client.set_timeout(60.0)
+            # server一次返回整个文本，之后逐行处理，不再split成列表再join
+            lines = iter_text_lines(client.show_recorder_file_info(args.recorder_filename, args.show_all))
+
+        if args.columnar:
+            actor_ids = [args.hero_id] if args.hero_id is not None else None
+            parser = RecorderTextParser(actor_ids)
+            writer = ColumnarWriter(args.columnar, args.chunk_frames)
+            writer.write_all(parser.parse(lines))
+            writer.close(parser.info)
+            print('wrote %d chunk(s) to %s: %s' % (
+                writer.chunks, args.columnar, ', '.join('%s=%d' % kv for kv in sorted(writer.rows.items()))))
+            if parser.unparsed:
+                print('%d line(s) not recognised' % parser.unparsed)
+            return
 
         #0416新添
         if args.hero_id is not None:
-            all_data = client.show_recorder_file_info(args.recorder_filename, args.show_all)
-            hero_data = [line for line in all_data.split('\n')if 'Version' in line or 'Map' in line or 'Date' in line or
-                         f'Id: {args.hero_id}' in line or 'Frame' in line or f'between {args.hero_id}' in line]  # 命令行中通过指定-i来确定hero的id
-            output_data = '\n'.join(hero_data)
-        else:
-            output_data = client.show_recorder_file_info(args.recorder_filename,args.show_all)
-
+            # 命令行中通过指定-i来确定hero的id，只保留与该id完全相同的行(123不会匹配1234)
+            lines = filter_text_lines(lines, args.hero_id)
 
         if args.save_to_file:
-                doc = open(args.save_to_file, "w+")
-                doc.write(output_data)
-                doc.close()
+            with open(args.save_to_file, "w+") as doc:
+                doc.writelines(lines)
         else:
             # print(client.show_recorder_file_info(args.recorder_filename, args.show_all))    #0416注释掉了
-            print(output_data)  #0416新添
-
+            for line in lines:
+                print(line, end='')  #0416新添
+            print()
 
     finally:
         pass
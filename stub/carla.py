@@ -0,0 +1,841 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Minimal stand-in for the CARLA Python API, for headless benchmarks and CI.
+
+Put this directory first on the path to use it instead of the real client:
+
+  PYTHONPATH=stub python ImmersiveDriveSim.py --headless --benchmark_ticks 500
+
+The server is simulated in-process: world.tick() moves every vehicle with a
+simple kinematic model and calls the sensor callbacks on the calling thread
+with synthetic data (BGRA camera frames, GNSS fixes and radar detections).
+Only the parts of the API used by the scripts in this repository exist.
+"""
+
+import array
+import copy
+import enum
+import fnmatch
+import itertools
+import math
+import os
+import random
+import sys
+
+libcarla = sys.modules[__name__]
+
+
+# ==============================================================================
+# -- geometry ------------------------------------------------------------------
+# ==============================================================================
+
+
+class Vector3D(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k):
+        return type(self)(self.x * k, self.y * k, self.z * k)
+
+    def length(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+    def __repr__(self):
+        return '%s(x=%.6f, y=%.6f, z=%.6f)' % (type(self).__name__, self.x, self.y, self.z)
+
+
+class Location(Vector3D):
+    def distance(self, other):
+        return (self - other).length()
+
+
+class Rotation(object):
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def get_forward_vector(self):
+        yaw = math.radians(self.yaw)
+        pitch = math.radians(self.pitch)
+        return Vector3D(math.cos(pitch) * math.cos(yaw), math.cos(pitch) * math.sin(yaw), math.sin(pitch))
+
+    def __repr__(self):
+        return 'Rotation(pitch=%.6f, yaw=%.6f, roll=%.6f)' % (self.pitch, self.yaw, self.roll)
+
+
+class Transform(object):
+    def __init__(self, location=None, rotation=None):
+        self.location = location if location is not None else Location()
+        self.rotation = rotation if rotation is not None else Rotation()
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+    def transform(self, location):
+        """Local location relative to this transform, in world coordinates (yaw only)."""
+        yaw = math.radians(self.rotation.yaw)
+        return Location(
+            self.location.x + location.x * math.cos(yaw) - location.y * math.sin(yaw),
+            self.location.y + location.x * math.sin(yaw) + location.y * math.cos(yaw),
+            self.location.z + location.z)
+
+    def __repr__(self):
+        return 'Transform(%r, %r)' % (self.location, self.rotation)
+
+
+class BoundingBox(object):
+    def __init__(self, location=None, extent=None):
+        self.location = location if location is not None else Location()
+        self.extent = extent if extent is not None else Vector3D()
+
+
+class GeoLocation(object):
+    def __init__(self, latitude=0.0, longitude=0.0, altitude=0.0):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+
+
+# ==============================================================================
+# -- controls and enums --------------------------------------------------------
+# ==============================================================================
+
+
+class VehicleControl(object):
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False,
+                 manual_gear_shift=False, gear=0):
+        self.throttle = throttle
+        self.steer = steer
+        self.brake = brake
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WalkerControl(object):
+    def __init__(self, direction=None, speed=0.0, jump=False):
+        self.direction = direction if direction is not None else Vector3D(1.0, 0.0, 0.0)
+        self.speed = speed
+        self.jump = jump
+
+
+class VehicleLightState(enum.IntFlag):
+    NONE = 0
+    Position = 0x1
+    LowBeam = 0x2
+    HighBeam = 0x4
+    Brake = 0x8
+    RightBlinker = 0x10
+    LeftBlinker = 0x20
+    Reverse = 0x40
+    Fog = 0x80
+    Interior = 0x100
+    Special1 = 0x200
+    Special2 = 0x400
+    All = 0xFFFFFFFF
+
+
+class ColorConverter(object):
+    Raw = 0
+    Depth = 1
+    LogarithmicDepth = 2
+    CityScapesPalette = 3
+
+
+class AttachmentType(object):
+    Rigid = 0
+    SpringArm = 1
+    SpringArmGhost = 2
+
+
+class WeatherParameters(object):
+    def __init__(self, cloudiness=0.0, precipitation=0.0, sun_altitude_angle=45.0):
+        self.cloudiness = cloudiness
+        self.precipitation = precipitation
+        self.sun_altitude_angle = sun_altitude_angle
+
+
+WeatherParameters.Default = WeatherParameters()
+WeatherParameters.ClearNoon = WeatherParameters(15.0, 0.0, 75.0)
+WeatherParameters.CloudyNoon = WeatherParameters(80.0, 0.0, 75.0)
+WeatherParameters.WetNoon = WeatherParameters(20.0, 0.0, 75.0)
+WeatherParameters.HardRainNoon = WeatherParameters(100.0, 100.0, 75.0)
+WeatherParameters.ClearSunset = WeatherParameters(15.0, 0.0, 15.0)
+WeatherParameters.ClearNight = WeatherParameters(15.0, 0.0, -80.0)
+
+
+# ==============================================================================
+# -- blueprints ----------------------------------------------------------------
+# ==============================================================================
+
+
+class ActorAttribute(object):
+    def __init__(self, id, value, recommended_values=()):
+        self.id = id
+        self.recommended_values = list(recommended_values)
+        self.value = str(value)
+
+    def as_str(self):
+        return self.value
+
+    def as_int(self):
+        return int(self.value)
+
+    def as_float(self):
+        return float(self.value)
+
+    def __str__(self):
+        return self.value
+
+
+class ActorBlueprint(object):
+    def __init__(self, id, attributes=None):
+        self.id = id
+        self.tags = id.split('.')
+        self._attributes = dict((k, ActorAttribute(k, *v)) for k, v in (attributes or {}).items())
+
+    def has_attribute(self, id):
+        return id in self._attributes
+
+    def get_attribute(self, id):
+        return self._attributes[id]
+
+    def set_attribute(self, id, value):
+        if id not in self._attributes:
+            raise IndexError('blueprint %s has no attribute %r' % (self.id, id))
+        self._attributes[id].value = str(value)
+
+    def __iter__(self):
+        return iter(self._attributes.values())
+
+
+class BlueprintLibrary(object):
+    def __init__(self, blueprints):
+        self._blueprints = list(blueprints)
+
+    def find(self, id):
+        for blueprint in self._blueprints:
+            if blueprint.id == id:
+                return copy.deepcopy(blueprint)
+        raise IndexError('blueprint %r not found' % id)
+
+    def filter(self, wildcard_pattern):
+        return BlueprintLibrary(b for b in self._blueprints if fnmatch.fnmatch(b.id, wildcard_pattern))
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+    def __getitem__(self, index):
+        return self._blueprints[index]
+
+
+_COLORS = ('255,255,255', '0,0,0', '200,20,20', '20,20,200')
+
+
+def _default_blueprints():
+    vehicle = lambda id: ActorBlueprint(id, {
+        'role_name': ('autopilot',), 'color': (_COLORS[0], _COLORS), 'number_of_wheels': ('4',)})
+    walker = lambda id: ActorBlueprint(id, {
+        'role_name': ('walker',), 'is_invincible': ('true',), 'speed': ('1.4', ('0.0', '1.4', '2.8'))})
+    camera = {'image_size_x': ('800',), 'image_size_y': ('600',), 'fov': ('90',),
+              'sensor_tick': ('0.0',), 'role_name': ('front',)}
+    return [vehicle('vehicle.audi.a2'), vehicle('vehicle.tesla.model3'), vehicle('vehicle.lincoln.mkz_2017'),
+            walker('walker.pedestrian.0001'), walker('walker.pedestrian.0002'),
+            ActorBlueprint('controller.ai.walker'),
+            ActorBlueprint('sensor.camera.rgb', camera),
+            ActorBlueprint('sensor.other.radar', {'horizontal_fov': ('30',), 'vertical_fov': ('30',),
+                                                  'range': ('100',), 'points_per_second': ('1500',)}),
+            ActorBlueprint('sensor.other.gnss'),
+            ActorBlueprint('sensor.other.collision'),
+            ActorBlueprint('sensor.other.lane_invasion')]
+
+
+# ==============================================================================
+# -- sensor data ---------------------------------------------------------------
+# ==============================================================================
+
+
+class Timestamp(object):
+    def __init__(self, frame=0, elapsed_seconds=0.0, delta_seconds=0.0, platform_timestamp=0.0):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = platform_timestamp
+
+
+class SensorData(object):
+    def __init__(self, frame, timestamp, transform):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.transform = transform
+
+
+class Image(SensorData):
+    def __init__(self, frame, timestamp, transform, width, height, fov, raw_data):
+        SensorData.__init__(self, frame, timestamp, transform)
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.raw_data = raw_data
+
+    def convert(self, color_converter):
+        pass
+
+
+class GnssMeasurement(SensorData):
+    def __init__(self, frame, timestamp, transform, latitude, longitude, altitude):
+        SensorData.__init__(self, frame, timestamp, transform)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+
+
+class RadarMeasurement(SensorData):
+    def __init__(self, frame, timestamp, transform, raw_data):
+        SensorData.__init__(self, frame, timestamp, transform)
+        self.raw_data = raw_data
+
+    def __len__(self):
+        return len(self.raw_data) // 16
+
+
+# ==============================================================================
+# -- actors --------------------------------------------------------------------
+# ==============================================================================
+
+
+class Actor(object):
+    def __init__(self, world, id, blueprint, transform, parent=None):
+        self._world = world
+        self.id = id
+        self.type_id = blueprint.id
+        self.attributes = dict((a.id, a.value) for a in blueprint)
+        self.parent = parent
+        self.is_alive = True
+        self.bounding_box = BoundingBox(Location(0.0, 0.0, 0.7), Vector3D(2.2, 0.9, 0.7))
+        self._transform = transform
+        self._velocity = Vector3D()
+        self._acceleration = Vector3D()
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        if self.parent is not None:
+            parent = self.parent.get_transform()
+            rotation = Rotation(parent.rotation.pitch + self._transform.rotation.pitch,
+                                parent.rotation.yaw + self._transform.rotation.yaw,
+                                parent.rotation.roll + self._transform.rotation.roll)
+            return Transform(parent.transform(self._transform.location), rotation)
+        return Transform(Location(self._transform.location.x, self._transform.location.y,
+                                  self._transform.location.z),
+                         Rotation(self._transform.rotation.pitch, self._transform.rotation.yaw,
+                                  self._transform.rotation.roll))
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        return self.parent.get_velocity() if self.parent is not None else Vector3D(
+            self._velocity.x, self._velocity.y, self._velocity.z)
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return self.parent.get_acceleration() if self.parent is not None else Vector3D(
+            self._acceleration.x, self._acceleration.y, self._acceleration.z)
+
+    def set_transform(self, transform):
+        self._transform = transform
+
+    def destroy(self):
+        if not self.is_alive:
+            return False
+        self.is_alive = False
+        self._world._actors.pop(self.id, None)
+        return True
+
+    def _step(self, dt):
+        pass
+
+
+class Vehicle(Actor):
+    def __init__(self, *args, **kwargs):
+        Actor.__init__(self, *args, **kwargs)
+        self._control = VehicleControl()
+        self._light_state = VehicleLightState.NONE
+        self._autopilot = False
+        self._speed = 0.0
+
+    def apply_control(self, control):
+        self._control = copy.copy(control)
+
+    def get_control(self):
+        return copy.copy(self._control)
+
+    def set_autopilot(self, enabled=True, tm_port=8000):
+        self._autopilot = enabled
+
+    def set_light_state(self, light_state):
+        self._light_state = VehicleLightState(int(light_state))
+
+    def get_light_state(self):
+        return self._light_state
+
+    def _step(self, dt):
+        control = self._control
+        if self._autopilot:
+            control = VehicleControl(throttle=0.4, steer=0.05 * math.sin(self._world._elapsed / 3.0))
+        throttle = -control.throttle if control.reverse else control.throttle
+        speed = self._speed + (6.0 * throttle - 0.3 * self._speed) * dt
+        if control.brake or control.hand_brake:
+            braking = 9.0 * max(control.brake, 1.0 if control.hand_brake else 0.0) * dt
+            speed = max(0.0, speed - braking) if speed > 0 else min(0.0, speed + braking)
+        rotation = self._transform.rotation
+        rotation.yaw = (rotation.yaw + 60.0 * control.steer * speed * dt / 5.0) % 360.0
+        forward = rotation.get_forward_vector()
+        velocity = Vector3D(forward.x * speed, forward.y * speed, 0.0)
+        self._acceleration = (velocity - self._velocity) * (1.0 / dt)
+        self._velocity = velocity
+        self._speed = speed
+        self._transform.location = self._transform.location + Location(velocity.x * dt, velocity.y * dt, 0.0)
+
+
+class Walker(Actor):
+    def apply_control(self, control):
+        self._velocity = control.direction * control.speed
+
+    def _step(self, dt):
+        self._transform.location = self._transform.location + Location(
+            self._velocity.x * dt, self._velocity.y * dt, 0.0)
+
+
+class WalkerAIController(Actor):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def go_to_location(self, location):
+        self._target = location
+
+    def set_max_speed(self, speed=1.4):
+        self._max_speed = speed
+
+
+class Sensor(Actor):
+    def __init__(self, *args, **kwargs):
+        Actor.__init__(self, *args, **kwargs)
+        self._callback = None
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    def listen(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+    def _measure(self, frame, timestamp):
+        return None
+
+    def _emit(self, frame, timestamp):
+        if self._callback is not None:
+            data = self._measure(frame, timestamp)
+            if data is not None:
+                self._callback(data)
+
+
+class Camera(Sensor):
+    # 预先生成几帧随机画面循环使用，基准测试只衡量客户端的开销
+    FRAME_POOL = 2
+
+    def __init__(self, *args, **kwargs):
+        Sensor.__init__(self, *args, **kwargs)
+        self.width = int(self.attributes.get('image_size_x', 800))
+        self.height = int(self.attributes.get('image_size_y', 600))
+        self.fov = float(self.attributes.get('fov', 90))
+        self._frames = [os.urandom(self.width * self.height * 4) for _ in range(self.FRAME_POOL)]
+
+    def _measure(self, frame, timestamp):
+        return Image(frame, timestamp, self.get_transform(), self.width, self.height, self.fov,
+                     self._frames[frame % len(self._frames)])
+
+
+class Gnss(Sensor):
+    def _measure(self, frame, timestamp):
+        location = self.get_location()
+        return GnssMeasurement(frame, timestamp, self.get_transform(),
+                               -location.y / 111320.0, location.x / 111320.0, location.z)
+
+
+class Radar(Sensor):
+    def _measure(self, frame, timestamp):
+        detections = array.array('f')
+        for _ in range(random.randint(0, 32)):
+            # velocity, azimuth, altitude, depth
+            detections.extend((random.uniform(-10.0, 5.0), random.uniform(-0.26, 0.26),
+                               random.uniform(-0.04, 0.04), random.uniform(2.5, 100.0)))
+        return RadarMeasurement(frame, timestamp, self.get_transform(), detections.tobytes())
+
+
+def _actor_class(type_id):
+    if type_id.startswith('vehicle.'):
+        return Vehicle
+    if type_id.startswith('walker.'):
+        return Walker
+    if type_id == 'controller.ai.walker':
+        return WalkerAIController
+    return {'sensor.camera.rgb': Camera, 'sensor.other.gnss': Gnss,
+            'sensor.other.radar': Radar}.get(type_id, Sensor if type_id.startswith('sensor.') else Actor)
+
+
+class ActorList(object):
+    def __init__(self, actors):
+        self._actors = list(actors)
+
+    def filter(self, wildcard_pattern):
+        return ActorList(a for a in self._actors if fnmatch.fnmatch(a.type_id, wildcard_pattern))
+
+    def find(self, actor_id):
+        for actor in self._actors:
+            if actor.id == actor_id:
+                return actor
+        return None
+
+    def __iter__(self):
+        return iter(self._actors)
+
+    def __len__(self):
+        return len(self._actors)
+
+    def __getitem__(self, index):
+        return self._actors[index]
+
+
+# ==============================================================================
+# -- world ---------------------------------------------------------------------
+# ==============================================================================
+
+
+class WorldSettings(object):
+    def __init__(self, synchronous_mode=False, no_rendering_mode=False, fixed_delta_seconds=None):
+        self.synchronous_mode = synchronous_mode
+        self.no_rendering_mode = no_rendering_mode
+        self.fixed_delta_seconds = fixed_delta_seconds
+
+
+class ActorSnapshot(object):
+    def __init__(self, actor):
+        self.id = actor.id
+        self._transform = actor.get_transform()
+        self._velocity = actor.get_velocity()
+        self._acceleration = actor.get_acceleration()
+
+    def get_transform(self):
+        return self._transform
+
+    def get_velocity(self):
+        return self._velocity
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return self._acceleration
+
+
+class WorldSnapshot(object):
+    def __init__(self, world_id, timestamp, actors):
+        self.id = world_id
+        self.frame = timestamp.frame
+        self.timestamp = timestamp
+        self._actors = dict((actor.id, ActorSnapshot(actor)) for actor in actors)
+
+    def find(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def has_actor(self, actor_id):
+        return actor_id in self._actors
+
+    def __iter__(self):
+        return iter(self._actors.values())
+
+    def __len__(self):
+        return len(self._actors)
+
+
+class Map(object):
+    def __init__(self, name, spawn_points):
+        self.name = name
+        self._spawn_points = spawn_points
+
+    def get_spawn_points(self):
+        return [Transform(Location(p.location.x, p.location.y, p.location.z),
+                          Rotation(p.rotation.pitch, p.rotation.yaw, p.rotation.roll)) for p in self._spawn_points]
+
+
+def _town_spawn_points():
+    # 两条互相垂直的双向四车道道路，每条车道每隔10米一个生成点
+    points = []
+    for lane, offset in enumerate((-5.25, -1.75, 1.75, 5.25)):
+        yaw = 0.0 if lane >= 2 else 180.0
+        for n in range(-10, 11):
+            points.append(Transform(Location(10.0 * n, offset, 0.3), Rotation(yaw=yaw)))
+            points.append(Transform(Location(offset, 10.0 * n + 5.0, 0.3), Rotation(yaw=yaw + 90.0)))
+    return points
+
+
+_episode_ids = itertools.count(1)
+
+
+class World(object):
+    def __init__(self, map_name='Town03'):
+        self.id = next(_episode_ids)
+        self._map = Map('Carla/Maps/' + map_name, _town_spawn_points())
+        self._library = BlueprintLibrary(_default_blueprints())
+        self._settings = WorldSettings()
+        self._weather = WeatherParameters.Default
+        self._actors = {}
+        self._actor_ids = itertools.count(1)
+        self._frame = 0
+        self._elapsed = 0.0
+        self._snapshot = WorldSnapshot(self.id, Timestamp(), [])
+        self._spectator = self._add_actor(ActorBlueprint('spectator'), Transform())
+
+    def _add_actor(self, blueprint, transform, attach_to=None):
+        actor = _actor_class(blueprint.id)(self, next(self._actor_ids), blueprint, transform, attach_to)
+        self._actors[actor.id] = actor
+        return actor
+
+    def get_settings(self):
+        return copy.copy(self._settings)
+
+    def apply_settings(self, settings):
+        self._settings = copy.copy(settings)
+        return self._frame
+
+    def get_blueprint_library(self):
+        return self._library
+
+    def get_map(self):
+        return self._map
+
+    def get_spectator(self):
+        return self._spectator
+
+    def get_weather(self):
+        return self._weather
+
+    def set_weather(self, weather):
+        self._weather = weather
+
+    def set_pedestrians_cross_factor(self, percentage):
+        pass
+
+    def get_random_location_from_navigation(self):
+        return Location(random.uniform(-100.0, 100.0), random.choice((-9.0, 9.0)), 0.5)
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return ActorList(self._actors.values())
+        return ActorList(self._actors[i] for i in actor_ids if i in self._actors)
+
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def try_spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        if attach_to is None and not blueprint.id.startswith(('sensor.', 'controller.')):
+            for actor in self._actors.values():
+                if (actor.type_id.startswith(('vehicle.', 'walker.')) and
+                        actor.get_location().distance(transform.location) < 2.0):
+                    return None
+        return self._add_actor(blueprint, copy.deepcopy(transform), attach_to)
+
+    def spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        actor = self.try_spawn_actor(blueprint, transform, attach_to, attachment_type)
+        if actor is None:
+            raise RuntimeError('Spawn failed because of collision at spawn position')
+        return actor
+
+    def _advance(self, dt):
+        self._frame += 1
+        self._elapsed += dt
+        actors = list(self._actors.values())
+        for actor in actors:
+            actor._step(dt)
+        timestamp = Timestamp(self._frame, self._elapsed, dt, self._elapsed)
+        self._snapshot = WorldSnapshot(self.id, timestamp, actors)
+        for actor in actors:
+            if isinstance(actor, Sensor) and actor.is_alive:
+                actor._emit(self._frame, timestamp)
+        return self._snapshot
+
+    def tick(self, seconds=10.0):
+        return self._advance(self._settings.fixed_delta_seconds or 0.05).frame
+
+    def wait_for_tick(self, seconds=10.0):
+        return self._advance(self._settings.fixed_delta_seconds or 0.05)
+
+    def get_snapshot(self):
+        return self._snapshot
+
+    def on_tick(self, callback):
+        return 0
+
+
+# ==============================================================================
+# -- commands ------------------------------------------------------------------
+# ==============================================================================
+
+
+class _Command(object):
+    def __init__(self):
+        self._then = []
+
+    def then(self, command):
+        self._then.append(command)
+        return self
+
+
+class _FutureActor(object):
+    pass
+
+
+class command(object):
+    FutureActor = _FutureActor()
+
+    class SpawnActor(_Command):
+        def __init__(self, blueprint, transform, parent=None):
+            _Command.__init__(self)
+            self.blueprint = blueprint
+            self.transform = transform
+            self.parent = parent
+
+    class DestroyActor(_Command):
+        def __init__(self, actor):
+            _Command.__init__(self)
+            self.actor_id = getattr(actor, 'id', actor)
+
+    class SetAutopilot(_Command):
+        def __init__(self, actor, enabled, tm_port=8000):
+            _Command.__init__(self)
+            self.actor = actor
+            self.enabled = enabled
+
+
+class _Response(object):
+    def __init__(self, actor_id=0, error=''):
+        self.actor_id = actor_id
+        self.error = error
+
+    def has_error(self):
+        return bool(self.error)
+
+
+# ==============================================================================
+# -- client --------------------------------------------------------------------
+# ==============================================================================
+
+
+class TrafficManager(object):
+    def __init__(self, port=8000):
+        self._port = port
+        self.synchronous_mode = False
+
+    def get_port(self):
+        return self._port
+
+    def set_synchronous_mode(self, mode=True):
+        self.synchronous_mode = mode
+
+    def global_percentage_speed_difference(self, percentage):
+        pass
+
+    def update_vehicle_lights(self, actor, do_update):
+        pass
+
+
+class Client(object):
+    def __init__(self, host='127.0.0.1', port=2000, worker_threads=0):
+        self._world = World()
+        self._recording = None
+
+    def set_timeout(self, seconds):
+        pass
+
+    def get_world(self):
+        return self._world
+
+    def load_world(self, map_name, reset_settings=True):
+        settings = None if reset_settings else self._world.get_settings()
+        self._world = World(map_name)
+        if settings is not None:
+            self._world.apply_settings(settings)
+        return self._world
+
+    def get_trafficmanager(self, port=8000):
+        return TrafficManager(port)
+
+    def start_recorder(self, filename, additional_data=False):
+        self._recording = filename
+        return filename
+
+    def stop_recorder(self):
+        self._recording = None
+
+    def show_recorder_file_info(self, filename, show_all=False):
+        return 'Version: 1\nMap: %s\nDate: 01/01/24 00:00:00\n\nFrames: 0\nDuration: 0 seconds\n' % (
+            self._world.get_map().name.split('/')[-1])
+
+    def apply_batch_sync(self, commands, do_tick=False):
+        responses = [self._apply(c) for c in commands]
+        if do_tick:
+            self._world.tick()
+        return responses
+
+    def apply_batch(self, commands, do_tick=False):
+        self.apply_batch_sync(commands, do_tick)
+
+    def _apply(self, cmd):
+        world = self._world
+        if isinstance(cmd, command.SpawnActor):
+            parent = world.get_actor(cmd.parent) if cmd.parent is not None else None
+            actor = world.try_spawn_actor(cmd.blueprint, cmd.transform, parent)
+            if actor is None:
+                return _Response(error='Spawn failed because of collision at spawn position')
+            for then in cmd._then:
+                if isinstance(then, command.SetAutopilot):
+                    actor.set_autopilot(then.enabled)
+            return _Response(actor.id)
+        if isinstance(cmd, command.DestroyActor):
+            actor = world.get_actor(cmd.actor_id)
+            if actor is None:
+                return _Response(error='actor %d not found' % cmd.actor_id)
+            actor.destroy()
+            return _Response(cmd.actor_id)
+        if isinstance(cmd, command.SetAutopilot):
+            world.get_actor(getattr(cmd.actor, 'id', cmd.actor)).set_autopilot(cmd.enabled)
+            return _Response(getattr(cmd.actor, 'id', cmd.actor))
+        return _Response(error='unsupported command %s' % type(cmd).__name__)
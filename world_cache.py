@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Client-side caches of CARLA world state.
+
+WorldStateCache keeps the carla.WorldSnapshot of the last tick so per-frame
+code can look actors up locally instead of sending one RPC per actor.
+MapCache keeps what does not change until the next load_world: the blueprint
+library, the map, its spawn points and a pool of navigation locations.
+"""
+
+import json
+import math
+import os
+import random
+
+
+# ==============================================================================
+# -- WorldStateCache -----------------------------------------------------------
+# ==============================================================================
+
+
+class WorldStateCache(object):
+    """Transforms, velocities and accelerations of every actor at the last tick.
+
+    Call refresh(world) right after world.tick() in synchronous mode, or
+    wait(world) in asynchronous mode, then read actors by id in O(1).
+    """
+    def __init__(self):
+        self.snapshot = None
+        self.frame = None
+        self.elapsed_seconds = 0.0
+        self.delta_seconds = 0.0
+        self._actor_ids = None
+
+    def update(self, snapshot):
+        self.snapshot = snapshot
+        self.frame = snapshot.frame
+        self.elapsed_seconds = snapshot.timestamp.elapsed_seconds
+        self.delta_seconds = snapshot.timestamp.delta_seconds
+        self._actor_ids = None
+        return snapshot
+
+    def refresh(self, world):
+        # get_snapshot() returns the state the client already received with the tick
+        return self.update(world.get_snapshot())
+
+    def wait(self, world):
+        return self.update(world.wait_for_tick())
+
+    def find(self, actor_id):
+        if self.snapshot is None:
+            return None
+        return self.snapshot.find(actor_id)
+
+    def __contains__(self, actor_id):
+        return self.snapshot is not None and self.snapshot.has_actor(actor_id)
+
+    def actor_ids(self):
+        if self._actor_ids is None:
+            self._actor_ids = frozenset(actor.id for actor in self.snapshot) if self.snapshot is not None \
+                else frozenset()
+        return self._actor_ids
+
+    def transform(self, actor_id):
+        actor = self.find(actor_id)
+        return actor.get_transform() if actor is not None else None
+
+    def velocity(self, actor_id):
+        actor = self.find(actor_id)
+        return actor.get_velocity() if actor is not None else None
+
+    def angular_velocity(self, actor_id):
+        actor = self.find(actor_id)
+        return actor.get_angular_velocity() if actor is not None else None
+
+    def acceleration(self, actor_id):
+        actor = self.find(actor_id)
+        return actor.get_acceleration() if actor is not None else None
+
+
+# ==============================================================================
+# -- SpatialGrid ---------------------------------------------------------------
+# ==============================================================================
+
+
+class SpatialGrid(object):
+    """Uniform grid over the xy plane for radius queries around many points."""
+    def __init__(self, cell_size=10.0):
+        self.cell_size = float(cell_size)
+        self._cells = {}
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def insert(self, x, y, item=None):
+        self._cells.setdefault(self._cell(x, y), []).append((x, y, item))
+
+    def clear(self):
+        self._cells.clear()
+
+    def __len__(self):
+        return sum(len(cell) for cell in self._cells.values())
+
+    def nearby(self, x, y, radius):
+        """Items within radius of (x, y)."""
+        reach = int(math.ceil(radius / self.cell_size))
+        cx, cy = self._cell(x, y)
+        radius_sq = radius * radius
+        items = []
+        for ix in range(cx - reach, cx + reach + 1):
+            for iy in range(cy - reach, cy + reach + 1):
+                for px, py, item in self._cells.get((ix, iy), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 <= radius_sq:
+                        items.append(item)
+        return items
+
+    def is_free(self, x, y, radius):
+        reach = int(math.ceil(radius / self.cell_size))
+        cx, cy = self._cell(x, y)
+        radius_sq = radius * radius
+        for ix in range(cx - reach, cx + reach + 1):
+            for iy in range(cy - reach, cy + reach + 1):
+                for px, py, _ in self._cells.get((ix, iy), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 <= radius_sq:
+                        return False
+        return True
+
+
+# ==============================================================================
+# -- NavigationPool ------------------------------------------------------------
+# ==============================================================================
+
+
+NAVIGATION_CACHE_DIR = '.nav_cache'
+
+
+class NavigationPool(object):
+    """Navmesh points (x, y, z) no closer than min_spacing to each other.
+
+    take() hands points out once, for spawning; destination() may return any
+    point, for walker goals. With a sample function (and optionally a path)
+    take() tops the pool up from the navmesh when it runs out, and saves it.
+    """
+    def __init__(self, locations, min_spacing=2.0, sample=None, path=None):
+        self.min_spacing = min_spacing
+        self.sample = sample
+        self.path = path
+        self.locations = []
+        self.samples = 0            # points offered so far, including the ones dropped as too close
+        self._grid = SpatialGrid(cell_size=max(min_spacing, 1.0) * 4)
+        self._free = []
+        self.extend(locations)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def extend(self, locations):
+        """Adds the locations that keep min_spacing, returns how many were added."""
+        added = 0
+        for location in locations:
+            if location is None:
+                continue
+            self.samples += 1
+            if not isinstance(location, tuple):
+                location = (location.x, location.y, location.z)
+            x, y = location[0], location[1]
+            if self._grid.is_free(x, y, self.min_spacing):
+                self._grid.insert(x, y, location)
+                self.locations.append(location)
+                self._free.append(location)
+                added += 1
+        random.shuffle(self._free)
+        return added
+
+    def take(self, count):
+        """Up to count points not handed out before, sampling more if needed."""
+        if self.sample is not None and len(self._free) < count:
+            # 间距不够的点会被丢弃，连续两轮一个点都没加进来就不再补采
+            idle = 0
+            while len(self._free) < count and idle < 2:
+                idle = 0 if self.extend(self.sample() for _ in range(count - len(self._free))) else idle + 1
+            if self.path:
+                self.save(self.path)
+        taken = self._free[-count:] if count > 0 else []
+        del self._free[len(self._free) - len(taken):]
+        return taken
+
+    def destination(self, away_from=None, min_distance=10.0):
+        """A random point, at least min_distance from away_from (x, y) when possible."""
+        if not self.locations:
+            return None
+        for _ in range(8):
+            location = random.choice(self.locations)
+            if away_from is None or math.hypot(location[0] - away_from[0],
+                                               location[1] - away_from[1]) >= min_distance:
+                break
+        return location
+
+    @classmethod
+    def load(cls, path, min_spacing=2.0, sample=None):
+        with open(path) as f:
+            data = json.load(f)
+        pool = cls([tuple(location) for location in data['locations']], min_spacing, sample, path)
+        pool.samples = max(pool.samples, data.get('samples', 0))
+        return pool
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'min_spacing': self.min_spacing, 'samples': self.samples, 'locations': self.locations}, f)
+        os.replace(path + '.tmp', path)
+
+
+# ==============================================================================
+# -- MapCache ------------------------------------------------------------------
+# ==============================================================================
+
+
+class MapCache(object):
+    """Blueprint library, map, spawn points and navigation locations of one loaded map.
+
+    Everything is fetched from the server on first use and kept until the world
+    changes; use get_map_cache(world) to share one instance per episode.
+    """
+    def __init__(self, world):
+        self.world = world
+        self.episode_id = world.id
+        self.invalidate()
+
+    def invalidate(self):
+        self._blueprint_library = None
+        self._map = None
+        self._spawn_points = None
+        self._navigation_pool = None
+
+    @property
+    def blueprint_library(self):
+        if self._blueprint_library is None:
+            self._blueprint_library = self.world.get_blueprint_library()
+        return self._blueprint_library
+
+    def find(self, blueprint_id):
+        # the library hands out a copy, so callers may set attributes freely
+        return self.blueprint_library.find(blueprint_id)
+
+    def filter(self, pattern):
+        return self.blueprint_library.filter(pattern)
+
+    @property
+    def map(self):
+        if self._map is None:
+            self._map = self.world.get_map()
+        return self._map
+
+    @property
+    def spawn_points(self):
+        if self._spawn_points is None:
+            self._spawn_points = self.map.get_spawn_points()
+        return self._spawn_points
+
+    @property
+    def map_name(self):
+        return self.map.name.split('/')[-1]
+
+    def navigation_pool(self, size=500, min_spacing=2.0, cache_dir=NAVIGATION_CACHE_DIR):
+        """A NavigationPool built from size navmesh samples, kept on disk per map.
+
+        Only the points missing from the cache file are sampled from the
+        server, so after the first run a crowd costs no navigation RPCs. The
+        pool samples more points itself if take() asks for more than it has.
+        """
+        if self._navigation_pool is not None and self._navigation_pool.samples >= size:
+            return self._navigation_pool
+        path = os.path.join(cache_dir, self.map_name + '.json') if cache_dir else None
+        sample = self.world.get_random_location_from_navigation
+        pool = NavigationPool.load(path, min_spacing, sample) if path and os.path.exists(path) \
+            else NavigationPool([], min_spacing, sample, path)
+        missing = size - pool.samples
+        if missing > 0:
+            pool.extend(self.world.get_random_location_from_navigation() for _ in range(missing))
+            if path:
+                pool.save(path)
+        self._navigation_pool = pool
+        return pool
+
+    def spawn_planner(self, actors=(), clearance=0.5):
+        """A SpawnPlanner over this map's spawn points with the given actors already blocked."""
+        planner = SpawnPlanner(self.spawn_points, clearance)
+        planner.block_actors(actors)
+        return planner
+
+
+_map_caches = {}
+
+
+def get_map_cache(world):
+    """The MapCache of world's episode; a new one is built after load_world."""
+    cache = _map_caches.get(world.id)
+    if cache is None:
+        _map_caches.clear()
+        cache = _map_caches[world.id] = MapCache(world)
+    return cache
+
+
+# ==============================================================================
+# -- SpawnPlanner --------------------------------------------------------------
+# ==============================================================================
+
+
+# 普通轿车包围盒在水平面上的半长和半宽（米）
+VEHICLE_EXTENT = (2.5, 1.1)
+
+# 按blueprint的base_type取包围盒半长和半宽，取各类型中较大的车型，未知类型按普通轿车处理
+VEHICLE_EXTENTS = {
+    'car': VEHICLE_EXTENT,
+    'van': (3.2, 1.3),
+    'truck': (4.6, 1.6),
+    'bus': (5.8, 1.7),
+    'motorcycle': (1.2, 0.5),
+    'bicycle': (1.0, 0.5)}
+
+
+def blueprint_extent(blueprint):
+    """Half length and half width on the ground of the vehicles spawned from blueprint.
+
+    The size of a blueprint is only known once an actor is spawned, so it is
+    estimated from the blueprint's base_type attribute.
+    """
+    if blueprint.has_attribute('base_type'):
+        return VEHICLE_EXTENTS.get(str(blueprint.get_attribute('base_type')).lower(), VEHICLE_EXTENT)
+    return VEHICLE_EXTENT
+
+
+def _footprint_axes(footprint):
+    yaw = footprint[2]
+    return (math.cos(yaw), math.sin(yaw)), (-math.sin(yaw), math.cos(yaw))
+
+
+def _footprints_overlap(a, b, margin):
+    """Separating-axis test for two footprints (x, y, yaw in radians, half length, half width)."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    axes_a = _footprint_axes(a)
+    axes_b = _footprint_axes(b)
+    for ax, ay in axes_a + axes_b:
+        reach = 0.0
+        for footprint, (forward, side) in ((a, axes_a), (b, axes_b)):
+            reach += footprint[3] * abs(ax * forward[0] + ay * forward[1])
+            reach += footprint[4] * abs(ax * side[0] + ay * side[1])
+        if abs(dx * ax + dy * ay) > reach + margin:
+            return False
+    return True
+
+
+class SpawnPlanner(object):
+    """Hands out spawn points in random order, each at most once, skipping blocked ones.
+
+    Existing actors block their bounding box footprint and every point handed
+    out blocks the footprint of the vehicle about to spawn there, so one batch
+    never overlaps itself. A point too tight for one vehicle stays available
+    for smaller ones. The grid only narrows the candidates down; the exact
+    check is done on the oriented footprints.
+    """
+    def __init__(self, spawn_points, clearance=0.5, cell_size=10.0):
+        self.clearance = clearance
+        self._points = list(spawn_points)
+        random.shuffle(self._points)
+        self._grid = SpatialGrid(cell_size)
+        self._max_radius = 0.0
+
+    def __len__(self):
+        return len(self._points)
+
+    def block(self, x, y, yaw, half_length, half_width):
+        self._grid.insert(x, y, (x, y, math.radians(yaw), half_length, half_width))
+        self._max_radius = max(self._max_radius, math.hypot(half_length, half_width))
+
+    def block_actors(self, actors):
+        for actor in actors:
+            box = actor.bounding_box
+            transform = actor.get_transform()
+            yaw = math.radians(transform.rotation.yaw)
+            # 包围盒中心相对actor原点的偏移随车头方向旋转
+            x = transform.location.x + box.location.x * math.cos(yaw) - box.location.y * math.sin(yaw)
+            y = transform.location.y + box.location.x * math.sin(yaw) + box.location.y * math.cos(yaw)
+            self.block(x, y, transform.rotation.yaw, box.extent.x, box.extent.y)
+
+    def is_free(self, x, y, yaw, half_length, half_width):
+        footprint = (x, y, math.radians(yaw), half_length, half_width)
+        reach = math.hypot(half_length, half_width) + self._max_radius + self.clearance
+        for other in self._grid.nearby(x, y, reach):
+            if _footprints_overlap(footprint, other, self.clearance):
+                return False
+        return True
+
+    def take(self, count, extent=VEHICLE_EXTENT):
+        """Up to count spawn points free for a vehicle of the given extent (half length, half width).
+
+        Fewer come back only when no remaining point has room for that extent.
+        """
+        taken = []
+        rejected = []
+        while self._points and len(taken) < count:
+            point = self._points.pop()
+            footprint = (point.location.x, point.location.y, point.rotation.yaw) + tuple(extent)
+            if self.is_free(*footprint):
+                self.block(*footprint)
+                taken.append(point)
+            else:
+                rejected.append(point)
+        # 放回队首，之后的小车型仍可使用，但先尝试其余的点
+        self._points[:0] = rejected
+        return taken